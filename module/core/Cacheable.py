@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
 from typing import ClassVar
-import os, platform, subprocess
+import os, platform, subprocess, copy
 from module.core.FileSystem import FileSystem
+from module.core.utils import LRUCache
 import re
 
 def sanitize_filename(filename):
@@ -10,6 +11,24 @@ def sanitize_filename(filename):
     return sanitized
 
 
+def get_size(data):
+    """Size in bytes of loaded data, dataframes are measured with their memory usage"""
+    if hasattr(data, "memory_usage"):
+        return int(data.memory_usage(deep=True).sum())
+    return len(repr(data))
+
+
+def copy_data(data):
+    """Copy of loaded data so that callers can't alter what is cached"""
+    if hasattr(data, "memory_usage"):
+        return data.copy(deep=True)
+    return copy.deepcopy(data)
+
+
+# Process wide cache of loaded files, keyed on (filepath, mtime, size, reader arguments)
+LOAD_CACHE = LRUCache(maxsize=64, maxbytes=1024**3, sizeof=get_size)
+
+
 @dataclass
 class Cacheable:
     """
@@ -21,6 +40,8 @@ class Cacheable:
     If filepath is provided, it will be used as-is.
     All child classes must implement the generate(), load() and save() methods.
     Generate must either return something that can be saved or the save method should know how to handle it.
+    Child classes can read their file through read() to memoize loading in LOAD_CACHE,
+    in which case save() must call invalidate_cache().
     
     Args:
         filepath (str, optional): The path to the file. Defaults to None.
@@ -80,8 +101,41 @@ class Cacheable:
             "This method should be implemented for all custom Cacheables"
         )
         
+    def read(self, reader, *args, shared=False):
+        """
+        Reads the file with reader, memoized in the process wide LOAD_CACHE.
+        Entries are keyed on the file modification time and size so manual edits are reflected at runtime.
+
+        Args:
+            reader (Callable): Takes the filepath (and args) and returns the loaded data
+            args: Additional reader arguments (ex: columns to read), part of the cache key
+            shared (bool, optional): Return the cached data itself instead of a copy,
+                for callers that never modify it. Defaults to False.
+
+        Returns:
+            object: A copy of the loaded data (the loaded data if shared)
+        """
+        stat = os.stat(self.filepath)
+        key = (self.filepath, stat.st_mtime_ns, stat.st_size, repr(args))
+        if key in LOAD_CACHE:
+            return LOAD_CACHE[key] if shared else copy_data(LOAD_CACHE[key])
+        if not any(cached[:3] == key[:3] for cached in LOAD_CACHE):
+            self.invalidate_cache()
+        # inserting may evict the data itself (larger than maxbytes)
+        data = reader(self.filepath, *args)
+        LOAD_CACHE[key] = data
+        return data if shared else copy_data(data)
+
+    def invalidate_cache(self):
+        """
+        Removes the file from LOAD_CACHE, must be called when the file is written.
+        """
+        for key in [key for key in LOAD_CACHE if key[0] == self.filepath]:
+            del LOAD_CACHE[key]
+
     def delete(self):
         os.remove(self.filepath)
+        self.invalidate_cache()
                 
     def open(self):
         if self.is_saved:
@@ -116,15 +116,20 @@ class DataSelection:
             self.p_value_threshold or self.project_information.p_value_threshold
         )
 
-        self.data = HPLC(self.project).full_df #TODO clarify variables (plural?)
+        hplc = HPLC(self.project)
         self._region = self.region
         self._compound = self.compound
         self.compound = COMPOUND_CLASSES.get(self.compound, self.compound)
         self.region = REGION_CLASSES.get(self.region, self.region)
 
+        # Only ratios that are selected are calculated for lazy ratio projects
+        self.data = hplc.get_full_df(
+            None if self.compound is None else convert_parameter_to_list(self.compound)
+        ) #TODO clarify variables (plural?)
+
         self.experiment_options = self.experiment_information.experiments
         self.treatment_options = self.treatment_information.label.unique()
-        self.compound_options = self.data.compound.unique()
+        self.compound_options = pd.unique([*self.data.compound.unique(), *hplc.compounds])
         self.region_options = self.data.region.unique()
         self.remove_outliers_options = ["calculated", "eliminated", False]
 
@@ -165,7 +170,7 @@ class DataSelection:
                 is_outlier=lambda x: x != True
             )  # nan considered not outlier
 
-        self.data = self.data.select(value="notna")
+        self.data = self.data.select(value="notna").remove_unused_categories()
         if self.pool: 
             self.data[self.pool] = "all"
             
@@ -180,7 +185,7 @@ class DataSelection:
 
     def process_outliers(self):
         for (treatment, compound, region), data in self.data.groupby(
-            ["treatment", "compound", "region"]
+            ["treatment", "compound", "region"], observed=True
         ):
             if "suspected" in data.outlier_status.values:
                 title = f"{compound} in {region} for {treatment}"
@@ -1,12 +1,15 @@
-import os
+import os, pickle
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dataclasses import dataclass, field
 from typing import ClassVar
 from module.core.Cacheable import Cacheable
 import pandas as pd
 from module.core.utils import is_array_like
 ROOT = os.getcwd()  # This gives terminal location (terminal working dir)
+DATASET_FORMAT = os.environ.get("DATASET_FORMAT", "pickle")  # 'pickle' or 'parquet'
 
 
 def mask(df: pd.DataFrame, mask_conditions: dict):
@@ -16,21 +19,25 @@ def mask(df: pd.DataFrame, mask_conditions: dict):
         raise ValueError(
             f"Unknown columns: {absent_columns}, possible columns are {df.columns}"
         )
-    for key, value in mask_conditions.items():  # Refine selection
+    # callables are applied last, only to the rows that are still selected
+    for key, value in sorted(mask_conditions.items(), key=lambda item: callable(item[1])):
         column = pd.Series(df.index) if key == "index" else df[key] 
         if value is None:
             print(f"Skipping {column.name}, .select() ignores None for practical purpose s, use 'nan' (str) instead.")
         else:
             if callable(value):
-                sub_selection = column.apply(value)
+                # categorical apply maps categories and returns a categorical
+                column = column.astype(object) if column.dtype == "category" else column
+                sub_selection = np.zeros(len(df), dtype=bool)
+                sub_selection[selected] = column[selected].apply(value).astype(bool)
             elif is_array_like(value):
                 sub_selection = column.isin(value)
             else:
                 if value in ["nan", "notna"]:
-                    sub_selection = column.isna() if value is None else column.notna()
+                    sub_selection = column.isna() if value == "nan" else column.notna()
                 else:
                     sub_selection = column == value
-            selected &= sub_selection
+            selected &= np.asarray(sub_selection)
     return selected
 
 
@@ -39,6 +46,34 @@ def sub_select(df, selector):
     return df
 
 
+def inverted_index(column: pd.Series) -> dict:
+    """
+    Maps each (non null) value of a column to the sorted positions of the rows holding it.
+    Returns None if the column can't be indexed (unhashable values).
+    """
+    try:
+        return column.groupby(column, sort=False, observed=True).indices
+    except TypeError:
+        return None
+
+
+def is_indexable_condition(key, value) -> bool:
+    """
+    Equality and list conditions can be resolved with an inverted index,
+    callables, 'nan'/'notna' and null values need the column itself.
+    """
+    if key == "index" or value is None or callable(value):
+        return False
+    values = value if is_array_like(value) else [value]
+    try:
+        return not any(
+            pd.isna(item) or (isinstance(item, str) and item in ["nan", "notna"])
+            for item in values
+        )
+    except (TypeError, ValueError):
+        return False
+
+
 class SelectableDataFrame(pd.DataFrame):
 
     @property
@@ -48,6 +83,8 @@ class SelectableDataFrame(pd.DataFrame):
     def select(self, **selector) -> "SelectableDataFrame":
         """
         Filter the DataFrame based on a selector.
+        If the selection index is enabled (see build_selection_index) equality and list conditions
+        are resolved by intersecting row positions, remaining conditions only see the surviving rows.
 
         Args:
             selector (dict): A dictionary of column conditions to filter by. 
@@ -58,8 +95,66 @@ class SelectableDataFrame(pd.DataFrame):
             SelectableDataFrame: Filtered DataFrame that also includes the select method.
             Series: if selection conditions result in a single row
         """
-        sub_selection = sub_select(self, selector)
-        return sub_selection
+        if not self.has_selection_index:
+            return sub_select(self, selector)
+        positions, remaining = None, {}
+        for key, value in selector.items():
+            index = (
+                self.get_selection_index(key)
+                if key in self.columns and is_indexable_condition(key, value)
+                else None
+            )
+            if index is None:
+                remaining[key] = value
+                continue
+            matches = [
+                index[value] for value in dict.fromkeys(value if is_array_like(value) else [value])
+                if value in index
+            ]
+            key_positions = np.sort(np.concatenate(matches)) if matches else np.array([], dtype=np.intp)
+            positions = (
+                key_positions
+                if positions is None
+                else np.intersect1d(positions, key_positions, assume_unique=True)
+            )
+        if positions is None:
+            data = sub_select(self, remaining)
+        else:
+            data = self.take(positions)
+            data = sub_select(data, remaining) if remaining else data
+        return data.build_selection_index()
+
+    def build_selection_index(self) -> "SelectableDataFrame":
+        """
+        Enable the selection index, used by select() to avoid scanning the whole frame.
+        Column indexes are built on first use and reused by later selections on this frame.
+        Selections of an indexed frame are indexed too.
+        Modifying a column with df[column] = ... drops the index.
+
+        Returns:
+            SelectableDataFrame: self
+        """
+        if not self.has_selection_index:
+            # not a pandas attribute: not propagated to copies or slices
+            object.__setattr__(self, "_selection_index", {})
+        return self
+
+    @property
+    def has_selection_index(self) -> bool:
+        return getattr(self, "_selection_index", None) is not None
+
+    def get_selection_index(self, column: str) -> dict:
+        """
+        Inverted index (value -> row positions) of a column, see inverted_index.
+        """
+        if column not in self._selection_index:
+            self._selection_index[column] = inverted_index(self[column])
+        return self._selection_index[column]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.has_selection_index:
+            self._selection_index.clear()
     
     def extend(self, df: "Dataset|SelectableDataFrame|pd.DataFrame") -> "SelectableDataFrame":
         """
@@ -76,6 +171,21 @@ class SelectableDataFrame(pd.DataFrame):
         common_columns = self.columns.intersection(df.columns).to_list()
         return self.merge(df, on=common_columns, how="left")
 
+    def remove_unused_categories(self) -> "SelectableDataFrame":
+        """
+        Remove categories that are absent from categorical columns (ex: after a selection)
+        so that they don't appear in groupbys, statistics or plots.
+
+        Returns:
+            SelectableDataFrame: DataFrame with only used categories
+        """
+        return self.assign(
+            **{
+                column: self[column].cat.remove_unused_categories()
+                for column in self.columns[self.dtypes == "category"]
+            }
+        )
+
 @dataclass
 class Dataset(Cacheable):
     """
@@ -137,10 +247,20 @@ class Dataset(Cacheable):
         return iter([row for _, row in self.df.iterrows()])
 
 
+def project(df, columns=None, filters=None):
+    """
+    Applies a column projection and a selector (see SelectableDataFrame.select) to a loaded DataFrame.
+    """
+    if filters:
+        df = sub_select(df, filters)
+    return df[columns] if columns is not None else df
+
+
 @dataclass
 class PickleDataset(Dataset):
     """
     Dataset wrapper for pickle files
+    Columns and filters are applied in memory after loading the whole file.
 
     """
 
@@ -148,9 +268,157 @@ class PickleDataset(Dataset):
 
     def save(self, data: pd.DataFrame):
         data.to_pickle(self.filepath)
+        self.invalidate_cache()
 
-    def load(self) -> SelectableDataFrame:
-        return SelectableDataFrame(pd.read_pickle(self.filepath))
+    def load(self, columns=None, filters=None) -> SelectableDataFrame:
+        return SelectableDataFrame(project(self.read(pd.read_pickle), columns, filters))
+
+
+def to_parquet_filters(filters, pickled_columns):
+    """
+    Splits a selector into parquet reader filters (equality and list conditions)
+    and the remaining conditions that must be applied in memory.
+
+    Returns:
+        tuple(list, dict): Parquet filters and remaining selector
+    """
+    parquet_filters, remaining = [], {}
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if key in pickled_columns or key == "index" or callable(value):
+            remaining[key] = value
+        elif is_array_like(value):
+            parquet_filters.append((key, "in", list(value)))
+        elif value in ["nan", "notna"]:
+            remaining[key] = value
+        else:
+            parquet_filters.append((key, "==", value))
+    return parquet_filters, remaining
+
+
+def is_boolean_column(column: pd.Series) -> bool:
+    """
+    Whether the non null values of an object (or categorical) column are booleans, possibly mixed
+    with strings (ex: is_outlier, outlier_status with False for untested groups).
+    """
+    try:
+        values = column.cat.categories if isinstance(column.dtype, pd.CategoricalDtype) else column.dropna().unique()
+    except TypeError:  # unhashable values (lists..)
+        return False
+    types = {type(value) for value in values}
+    return bool(types & {bool, np.bool_}) and types <= {bool, np.bool_, str}
+
+
+def write_boolean_column(column: pd.Series) -> pd.Series:
+    """Booleans as a nullable boolean column, booleans mixed with strings as strings ('True', 'False')"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.rename_categories(str)
+    if all(isinstance(value, (bool, np.bool_)) for value in column.dropna().unique()):
+        return column.astype("boolean")
+    return column.map(str, na_action="ignore")
+
+
+def read_boolean_column(column: pd.Series) -> pd.Series:
+    """Inverse of write_boolean_column, missing values are NaN"""
+    booleans = {"True": True, "False": False}
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.rename_categories(
+            [booleans.get(category, category) for category in column.cat.categories]
+        )
+    values = column.to_numpy(dtype=object, copy=True)
+    values[column.isna().to_numpy()] = np.nan
+    for string, boolean in booleans.items():
+        values[values == string] = boolean
+    return pd.Series(values, index=column.index, name=column.name, dtype=object)
+
+
+def read_parquet(filepath, columns=None, filters=None):
+    """
+    Reads a parquet file written by ParquetDataset, pushing columns and filters down to the reader.
+    Pickled and boolean columns (see ParquetDataset.save) are restored.
+    """
+    table = pq.read_table(
+        filepath, columns=columns, filters=filters or None, use_pandas_metadata=True
+    )
+    data = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    for column in filter(None, metadata.get(b"pickled_columns", b"").decode().split(",")):
+        if column in data:
+            data[column] = data[column].apply(pickle.loads)
+    for column in filter(None, metadata.get(b"boolean_columns", b"").decode().split(",")):
+        if column in data:
+            data[column] = read_boolean_column(data[column])
+    return data
+
+
+@dataclass
+class ParquetDataset(Dataset):
+    """
+    Dataset wrapper for parquet files, columnar alternative to PickleDataset.
+    Label columns are dictionary encoded and load() can read only some columns and rows.
+    Object columns of booleans (and strings) are written as boolean (or string) columns,
+    other object columns that can't be stored in parquet (mixed types, DataFrames..) are pickled per value.
+
+    """
+
+    extension: ClassVar[str] = "parquet"
+    dictionary_columns: ClassVar[list] = ["compound", "region", "treatment", "outlier_status"]
+
+    def save(self, data: pd.DataFrame):
+        data = data.copy()
+        pickled_columns, boolean_columns = [], []
+        for column in data.columns[(data.dtypes == object) | (data.dtypes == "category")]:
+            if is_boolean_column(data[column]):
+                data[column] = write_boolean_column(data[column])
+                boolean_columns.append(column)
+                continue
+            try:
+                pa.array(data[column], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                data[column] = data[column].astype(object).apply(pickle.dumps)
+                pickled_columns.append(column)
+        table = pa.Table.from_pandas(data)
+        table = table.replace_schema_metadata(
+            {
+                **table.schema.metadata,
+                b"pickled_columns": ",".join(pickled_columns).encode(),
+                b"boolean_columns": ",".join(boolean_columns).encode(),
+            }
+        )
+        pq.write_table(
+            table,
+            self.filepath,
+            use_dictionary=[column for column in self.dictionary_columns if column in data and column not in pickled_columns],
+        )
+        self.invalidate_cache()
+
+    def load(self, columns=None, filters=None) -> SelectableDataFrame:
+        """
+        Reads the file, equality and list filters are applied by the parquet reader.
+
+        Args:
+            columns (list[str], optional): Columns to read. Defaults to None (all).
+            filters (dict, optional): Selector, see SelectableDataFrame.select. Defaults to None.
+
+        Returns:
+            SelectableDataFrame: The loaded data
+        """
+        metadata = pq.read_schema(self.filepath).metadata or {}
+        # pickled and boolean columns are stored encoded, their conditions are applied in memory
+        in_memory_columns = [
+            column
+            for key in [b"pickled_columns", b"boolean_columns"]
+            for column in metadata.get(key, b"").decode().split(",")
+        ]
+        parquet_filters, remaining = to_parquet_filters(filters, in_memory_columns)
+        read_columns = columns if columns is None else [*columns, *[key for key in remaining if key not in columns and key != "index"]]
+        data = self.read(read_parquet, read_columns, parquet_filters)
+        return SelectableDataFrame(project(data, columns, remaining))
+
+
+# Storage of the large project datasets (hplc, outliers, statistics), set with the DATASET_FORMAT environment variable
+ProjectDataset = ParquetDataset if DATASET_FORMAT == "parquet" else PickleDataset
 
 
 @dataclass
@@ -164,6 +432,7 @@ class ExcelDataset(Dataset):
 
     def save(self, data: pd.DataFrame):
         data.to_excel(self.filepath)
+        self.invalidate_cache()
 
     def load(self) -> SelectableDataFrame:
-        return SelectableDataFrame(pd.read_excel(self.filepath))
+        return SelectableDataFrame(self.read(pd.read_excel))
@@ -10,7 +10,7 @@ from module.core.Statistics import QuantitativeStatistic
 from module.core.Metadata import (
     Palette,
 )
-from module.core.Matrix import Matrix
+from module.core.Matrix import Matrix, MatrixStore, calculate_matrices
 from module.core.Matrix import Network as NetworkModel
 from module.core.Constants import COMPOUNDS_AND_REGIONS, REGIONS, REGION_CLASSES_POSITIONS
 from matplotlib import pyplot as plt
@@ -20,7 +20,6 @@ import numpy as np
 from IPython.display import Image, display
 import pandas as pd
 import os
-from module.core.utils import parallel_process
 from statannotations.Annotator import Annotator
 from module.core.DataSelection import DataSelection, QuantitativeDataSelection
 from module.core.Constants import REGION_CLASSES, COMPOUND_CLASSES
@@ -309,6 +308,11 @@ class MatricesFigure(Figure(DataSelection)):
     columns: list[str] = field(default=None)
     n_minimum: float = field(default=5)
     method: float = field(default="pearson")
+    significance: str = field(default="parametric", kw_only=True)
+    n_resamples: int = field(default=1000, kw_only=True)
+    seed: int = field(default=None, kw_only=True)
+    correction: str = field(default=None, kw_only=True)
+    persist_matrices: bool = field(default=False, kw_only=True)
 
     def __post_init__(self):
         if self.compound and "-" in self.compound:
@@ -344,10 +348,15 @@ class MatricesFigure(Figure(DataSelection)):
                 self.n_minimum,
                 self.method,
                 self.p_value_threshold,
+                significance=self.significance,
+                n_resamples=self.n_resamples,
+                seed=self.seed,
+                correction=self.correction,
             )
             for treatment in self.treatments
-        ]  # Setup multiprocessing pool
-        self.matrices = parallel_process(cases, description="Creating matrices")
+        ]
+        store = MatrixStore(self.project, self.experiment) if self.persist_matrices else None
+        self.matrices = calculate_matrices(cases, store)
 
     def homogenize_matrices(self):
         conserved_rows = set.intersection(
@@ -457,10 +466,7 @@ class Network(MatricesFigure):
 
     def setup_plotter_parameters(self):
         super().setup_plotter_parameters()
-        self.networks = parallel_process(
-            [NetworkModel(matrix) for matrix in self.matrices],
-            description="Creating networks",
-        )
+        self.networks = [NetworkModel(matrix, delay_execution=False) for matrix in self.matrices]
 
     def generate(self):
         super().generate()
@@ -588,6 +594,9 @@ class Network(MatricesFigure):
             f"edges = {network.total_edges}, pos = {network.pos_edges}, neg = {network.neg_edges}",
             f"density = {network.density}, max degree = {network.max_degree}, average degree = {network.average_degree}",
             f"unweighted clustering co = {network.avg_clust_coeff_unweighted}",
+            f"global efficiency = {network.global_eff_unweighted} (weighted {network.global_eff_weighted})",
+            f"local efficiency = {network.local_eff_unweighted} (weighted {network.local_eff_weighted})",
+            f"characteristic path length = {network.path_length_unweighted} (weighted {network.path_length_weighted})",
         )
 
         return ax
@@ -652,7 +661,7 @@ class Table(ExcelDataset, Figure(QuantitativeDataSelection)):
 
     def generate(self):
         grouped = (
-            self.data.groupby(["region", "compound", "treatment"])
+            self.data.groupby(["region", "compound", "treatment"], observed=True)
             .agg(
                 mean_value=("value", "mean"),
                 std_value=("value", lambda x: np.std(x, ddof=1)),
@@ -671,6 +680,7 @@ class Table(ExcelDataset, Figure(QuantitativeDataSelection)):
             columns=["compound", "treatment"],
             values="mean ± STD",
             aggfunc="first",
+            observed=True,
         )
 
         # Sort the multiindex columns
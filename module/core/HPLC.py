@@ -1,9 +1,9 @@
-import os, re
+import os, re, json
 from dataclasses import dataclass
 from typing import ClassVar
 import pandas as pd
 import numpy as np
-from module.core.Dataset import PickleDataset, SelectableDataFrame
+from module.core.Dataset import PickleDataset, ProjectDataset, SelectableDataFrame, project as project_data
 from module.core.Metadata import (
     ProjectInformation,
     ExperimentInformation,
@@ -11,9 +11,8 @@ from module.core.Metadata import (
 )
 from module.core.questions import yes_or_no, input_escape
 from module.core.Constants import REGIONS, COMPOUNDS
-from tqdm import tqdm
-from outliers import smirnov_grubbs as grubbs
-from module.core.utils import parallel_process
+from scipy import stats
+from module.core.utils import is_array_like, LRUCache
 
 
 def detect_raw_data(project):
@@ -85,6 +84,133 @@ class RawHPLC(PickleDataset):
         }
 
 
+RATIO_CACHE = LRUCache(maxsize=64)
+OUTLIER_STATUSES = ["normal", "suspected", "kept", "eliminated"]
+
+
+def categorize(data, project=None):
+    """
+    Converts label columns (compound, region, treatment, outlier_status) of data to pd.Categorical inplace.
+    Compound and region categories follow the COMPOUNDS and REGIONS order, treatments follow TreatmentInformation.
+    Values absent from these (ratios, weight...) are appended in order of appearance.
+
+    Args:
+        data (pd.DataFrame): Data with label columns
+        project (str, optional): Required to order treatments. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The data with categorical label columns
+    """
+    orders = {
+        "compound": COMPOUNDS.list,
+        "region": REGIONS.list,
+        "outlier_status": OUTLIER_STATUSES,
+    }
+    if project is not None and "treatment" in data:
+        orders["treatment"] = TreatmentInformation(project).label.to_list()
+    for column, order in orders.items():
+        if column in data:
+            values = list(data[column].dropna().unique())
+            present = set(values)
+            categories = [value for value in order if value in present]
+            ordered = set(categories)
+            categories += [value for value in values if value not in ordered]
+            data[column] = pd.Categorical(data[column], categories=categories)
+    return data
+
+
+def concat_categorized(frames, project=None) -> pd.DataFrame:
+    """
+    pd.concat of frames keeping categorical columns categorical, concatenating different
+    categories would fall back to object. Categories are unioned before concatenating and
+    ordered with categorize.
+
+    Args:
+        frames (list[pd.DataFrame]): Frames to concatenate
+        project (str, optional): Required to order treatments. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The concatenated frames with categorical label columns
+    """
+    frames = list(frames)
+    columns = {
+        column
+        for frame in frames
+        for column in frame.columns[frame.dtypes == "category"]
+    }
+    for column in columns:
+        categories = pd.unique(
+            np.concatenate(
+                [
+                    frame[column].cat.categories.to_numpy(dtype=object)
+                    if isinstance(frame[column].dtype, pd.CategoricalDtype)
+                    else frame[column].dropna().unique().astype(object)
+                    for frame in frames
+                    if column in frame
+                ]
+            )
+        )
+        frames = [
+            frame.assign(**{column: pd.Categorical(frame[column], categories=categories)})
+            if column in frame
+            else frame
+            for frame in frames
+        ]
+    return categorize(pd.concat(frames), project)
+
+
+def get_ratio_names(compounds):
+    return [
+        f"{compound_1}/{compound_2}"
+        for compound_1 in compounds
+        for compound_2 in compounds
+        if compound_1 != compound_2
+    ]
+
+
+def calculate_ratios(compound_data, ratios=None):
+    """
+    Calculates every compound/compound ratio for each mouse and region.
+    Ratios are computed column-wise on the self-merged data rather than row by row.
+    A ratio is NaN if either value is missing or 0.
+
+    Args:
+        compound_data (pd.DataFrame): Long format data with mouse_id, group_id, value, compound and region columns
+        ratios (list[str], optional): Only calculate these ratios ('compound_1/compound_2'). Defaults to None (all).
+
+    Returns:
+        pd.DataFrame: Ratio rows with the same columns, compound is named 'compound_1/compound_2'
+    """
+    left = right = compound_data
+    if ratios is not None:
+        numerators, denominators = zip(*[ratio.split("/", 1) for ratio in ratios]) if ratios else ([], [])
+        left = compound_data[compound_data.compound.isin(numerators)]
+        right = compound_data[compound_data.compound.isin(denominators)]
+    ratio_data = pd.merge(
+        left=left,
+        right=right,
+        on=[
+            "mouse_id",
+            "group_id",
+            "region",
+        ],
+        suffixes=["_1", "_2"],
+    ).reset_index(
+        drop=True
+    )  # merge every compound to every other for each mouse, we want to reset the index (ie make sure it has no duplicates) becaus many update operations will use it
+
+    ratio_data = ratio_data[(ratio_data.compound_1 != ratio_data.compound_2)]
+    ratio_data = ratio_data.assign(
+        compound=ratio_data.compound_1.astype(str) + "/" + ratio_data.compound_2.astype(str),
+        value=(ratio_data.value_1 / ratio_data.value_2).where(
+            (ratio_data.value_1 != 0) & (ratio_data.value_2 != 0)
+        ),
+    )
+    if ratios is not None:
+        ratio_data = ratio_data[ratio_data.compound.isin(ratios)]
+    return ratio_data.drop(columns=["compound_1", "compound_2", "value_1", "value_2"])
+
+
 class ProjectSelectableDataframe(SelectableDataFrame):
     """
     Shameful hack.
@@ -104,11 +230,24 @@ class ProjectSelectableDataframe(SelectableDataFrame):
         if experiment:
             experiment = ExperimentInformation(self.project).select(label=experiment)
             selector["group_id"] = experiment.groups
-        data = SelectableDataFrame(self).select(**selector)
-        return ProjectSelectableDataframe(data, project=self.project) if hasattr(self, "project") else data
+        data = super().select(**selector)
+        if hasattr(self, "project"):
+            data = ProjectSelectableDataframe(data, project=self.project)
+        return data.build_selection_index() if self.has_selection_index else data
+
+# Label columns of the FullHPLC snapshot, HPLC.select pushes their conditions down to the reader
+SNAPSHOT_FILTER_COLUMNS = ["compound", "region", "mouse_id", "group_id", "treatment"]
+
 
 @dataclass(repr=False)
-class HPLC(PickleDataset):
+class HPLC(ProjectDataset):
+    """
+    Compound values and compound/compound ratios for every mouse and region.
+    With the lazy_ratios project setting (see ProjectInformation) only compound values are stored,
+    ratios are calculated (and cached) when they are selected and the datasets built
+    on hplc (Outliers, FullHPLC) don't store them either.
+    The storage mode is read from the file, the setting only matters for generation.
+    """
 
     project: str
     filename: ClassVar[str] = "hplc"
@@ -122,130 +261,571 @@ class HPLC(PickleDataset):
             "_", expand=True
         )
         compound_data = compound_data.drop(columns=["variable"])
-        ratio_data = pd.merge(
-            left=compound_data,
-            right=compound_data,
-            on=[
-                "mouse_id",
-                "group_id",
-                "region",
-            ],
-            suffixes=["_1", "_2"],
-        ).reset_index(
-            drop=True
-        )  # merge every compound to every other for each mouse, we want to reset the index (ie make sure it has no duplicates) becaus many update operations will use it
-
-        ratio_data = ratio_data[(ratio_data.compound_1 != ratio_data.compound_2)]
-
-        def calculateRatio(row):
-            ratio_name = f"{row.compound_1}/{row.compound_2}"
-            return [
-                ratio_name,
-                row.value_1 / row.value_2 if row.value_1 and row.value_2 else np.nan,
-            ]
-
-        tqdm.pandas(desc="Calculating ratios", unit="ratio")
-
-        ratio_data[["compound", "value"]] = ratio_data.progress_apply(
-            calculateRatio,
-            axis=1,
-            result_type="expand",
-        )  # calculate ratio
-        # Drop duplicate columns
+        if ProjectInformation(self.project).lazy_ratios:
+            return categorize(compound_data.replace(0, np.nan))
+        ratio_data = calculate_ratios(compound_data)
         compound_and_ratios_df = pd.concat(
             [
                 compound_data,
-                ratio_data.drop(
-                    columns=["compound_1", "compound_2", "value_1", "value_2"]
-                ),
+                ratio_data,
             ]
         )
-        return compound_and_ratios_df.replace(0, np.nan)
-    
+        return categorize(compound_and_ratios_df.replace(0, np.nan))
+
     def select(self, **selector) -> ProjectSelectableDataframe:
-        return self.full_df.select(**selector)
+        filters = {key: value for key, value in selector.items() if key in SNAPSHOT_FILTER_COLUMNS}
+        return self.get_full_df(selector.get("compound"), filters).select(**selector)
 
     @property
     def full_df(self) -> ProjectSelectableDataframe:
-        data = ProjectSelectableDataframe(pd.concat([self.df, TissueWeight(self.project).df]))
+        return self.get_full_df()
+
+    def get_full_df(self, compound=None, filters=None) -> ProjectSelectableDataframe:
+        """
+        Hplc data extended with tissue weight, outliers and treatment information.
+        Read from the FullHPLC snapshot, in lazy mode the ratios required by compound are added on read.
+
+        Args:
+            compound (str|list, optional): Compounds that will be selected, limits the ratios calculated in lazy mode. Defaults to None (all).
+            filters (dict, optional): Selector of snapshot columns applied when reading (see SNAPSHOT_FILTER_COLUMNS),
+                derived ratios are not filtered. Defaults to None.
+
+        Returns:
+            ProjectSelectableDataframe: The full data
+        """
+        data = FullHPLC(self.project).load(filters=filters)
+        ratio_data = self.derive_ratios(compound)
+        if len(ratio_data):
+            data = concat_categorized(
+                [data, self.merge_information(ratio_data, ratio_data=ratio_data)], self.project
+            )
+        # the full data is selected repeatedly (DataSelection, Statistics, figures)
+        return ProjectSelectableDataframe(data, self.project).build_selection_index()
+
+    def build_full_df(self, apply_journal=True) -> ProjectSelectableDataframe:
+        """
+        Merges the stored hplc data and tissue weight with outliers and treatment information.
+        In lazy mode ratios are not included, see get_full_df.
+
+        Args:
+            apply_journal (bool, optional): Include manual outlier edits, see Outliers.load. Defaults to True.
+
+        Returns:
+            ProjectSelectableDataframe: The full data
+        """
+        return self.merge_information(
+            concat_categorized([self.df, TissueWeight(self.project).df]), apply_journal
+        )
+
+    def merge_information(self, data, apply_journal=True, ratio_data=None) -> ProjectSelectableDataframe:
+        """
+        Extends hplc rows with the outliers of their compounds and treatment information.
+
+        Args:
+            data (pd.DataFrame): Hplc rows
+            apply_journal (bool, optional): Include manual outlier edits, see Outliers.load. Defaults to True.
+            ratio_data (pd.DataFrame, optional): Ratio rows already derived, see Outliers.load. Defaults to None.
+
+        Returns:
+            ProjectSelectableDataframe: The extended rows
+        """
+        outliers = Outliers(self.project).load(
+            filters={"compound": list(data.compound.unique())},
+            apply_journal=apply_journal,
+            ratio_data=ratio_data,
+        )
         data = ProjectSelectableDataframe(
-            data.extend(Outliers(self.project)).extend(
+            SelectableDataFrame(data).extend(outliers).extend(
                 TreatmentInformation(self.project)
             ), self.project
         )
+        data = categorize(data, self.project)
         return data[[col for col in data.columns if "Unnamed" not in col]]
 
+    @property
+    def stores_ratios(self) -> bool:
+        return has_ratios(self.load(columns=["compound"]))
+
+    def materialize(self, compound=None) -> SelectableDataFrame:
+        """
+        Hplc data including the ratio rows required by compound.
+        If ratios are stored (default) this is the same as df.
+
+        Args:
+            compound (str|list, optional): Compounds that will be selected. Defaults to None (all ratios).
+
+        Returns:
+            SelectableDataFrame: Compound and ratio rows
+        """
+        data = self.df
+        ratio_data = self.derive_ratios(compound, data)
+        if not len(ratio_data):
+            return data
+        return SelectableDataFrame(concat_categorized([data, ratio_data]))
+
+    def derive_ratios(self, compound=None, data=None) -> pd.DataFrame:
+        """
+        Ratio rows required by compound that are not stored (lazy mode).
+
+        Args:
+            compound (str|list, optional): Compounds that will be selected. Defaults to None (all ratios).
+            data (pd.DataFrame, optional): The stored data if already loaded. Defaults to None.
+
+        Returns:
+            pd.DataFrame: Ratio rows, empty if ratios are stored or none is required
+        """
+        data = self.df if data is None else data
+        if has_ratios(data):
+            return data.iloc[:0]
+        if is_array_like(compound):
+            compounds = list(compound)
+        elif compound is None or callable(compound) or compound in ["nan", "notna"]:
+            return calculate_ratios(data)
+        else:
+            compounds = [compound]
+        ratios = [compound for compound in compounds if "/" in compound]
+        if not ratios:
+            return data.iloc[:0]
+        return self.get_ratios(data, ratios)
+
+    def get_ratios(self, data, ratios) -> pd.DataFrame:
+        """
+        Calculates ratios from compound data, recently used ratios are cached in RATIO_CACHE.
+        Cache entries are keyed on the file modification time so manual edits are reflected.
+
+        Args:
+            data (pd.DataFrame): Compound data
+            ratios (list[str]): Ratios to calculate ('compound_1/compound_2')
+
+        Returns:
+            pd.DataFrame: Ratio rows
+        """
+        modified = os.path.getmtime(self.filepath)
+        keys = {ratio: (self.filepath, modified, ratio) for ratio in ratios}
+        # cached frames are collected before inserting, new entries may evict them
+        ratio_data = {ratio: RATIO_CACHE[key] for ratio, key in keys.items() if key in RATIO_CACHE}
+        missing = [ratio for ratio in keys if ratio not in ratio_data]
+        if missing:
+            calculated = dict(list(calculate_ratios(data, missing).groupby("compound", observed=True)))
+            empty = data.iloc[:0]
+            for ratio in missing:
+                ratio_data[ratio] = calculated.get(ratio, empty)
+                RATIO_CACHE[keys[ratio]] = ratio_data[ratio]
+        return pd.concat([ratio_data[ratio] for ratio in keys])
+
     @property
     def compounds(self):
-        return self.df.compound.unique()
+        data = self.load(columns=["compound"])
+        compounds = data.compound.unique()
+        if has_ratios(data):
+            return compounds
+        return np.append(compounds, get_ratio_names(compounds))
 
     @property
     def regions(self):
-        return self.df.region.unique()
+        return self.load(columns=["region"]).region.unique()
 
     @property
     def compounds_and_regions(self):
         return {
-            "compounds": self.df.compound.unique(),
-            "regions": self.df.region.unique(),
+            "compounds": self.compounds,
+            "regions": self.regions,
         }
 
 
-def grubbs_test(values, p_value_threshold):
+def has_ratios(data):
+    return data.compound.str.contains("/").any()
+
+
+def get_signature(filepaths) -> dict:
+    """Modification time and size of files (None if absent), used to detect changes"""
+    signature = {}
+    for filepath in filepaths:
+        stat = os.stat(filepath) if os.path.isfile(filepath) else None
+        signature[filepath] = stat and [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+@dataclass(repr=False)
+class FullHPLC(ProjectDataset):
     """
-    Takes a list of values on which to perform the test and returns normal values
+    Snapshot of HPLC.full_df, saves the merges with tissue weight, outliers and treatment information.
+    The signature of its dependencies is stored next to it and the snapshot is
+    regenerated on load when any of them changed.
+    Manual outlier edits (the Outliers journal) are applied on load, they only
+    trigger a rebuild once compacted into the outliers file.
     """
-    return grubbs.test(values, alpha=float(p_value_threshold))
-
-
-def get_labeled_df(df__test__p_value_threshold):
-    # if standar variation is 0, we can't calculate outliers
-    df, test, p_value_threshold = df__test__p_value_threshold
-    only_values = df[df.value != 0].dropna()
-    if only_values.value.count() < 3:
-        df["outlier_status"] = False
-        return df
-    outlier_test = OUTLIER_TESTS[test]
-    normal_values = outlier_test(only_values.value.tolist(), p_value_threshold)
-    df["is_outlier"] = df.value.apply(lambda value: value not in normal_values)
-    df["outlier_status"] = df.is_outlier.apply(
-        lambda is_outlier: "suspected" if is_outlier else "normal"
+
+    project: str
+    filename: ClassVar[str] = "full_hplc"
+
+    def generate(self):
+        return pd.DataFrame(HPLC(self.project).build_full_df(apply_journal=False))
+
+    def save(self, data: pd.DataFrame):
+        super().save(data)
+        with open(self.signature_filepath, "w") as signature_file:
+            json.dump(get_signature(self.dependency_filepaths), signature_file)
+
+    def load(self, columns=None, filters=None) -> SelectableDataFrame:
+        if self.is_outdated:
+            self.initialize()
+        journal_filepath = Outliers(self.project).journal_filepath
+        if not os.path.isfile(journal_filepath):
+            return super().load(columns, filters)
+        # edits change outlier_status, filters on it are applied after the journal
+        data = super().load(filters={key: value for key, value in (filters or {}).items() if key != "outlier_status"})
+        data = apply_outlier_journal(data, read_outlier_journal(journal_filepath))
+        return SelectableDataFrame(project_data(data, columns, filters))
+
+    def delete(self):
+        super().delete()
+        if os.path.isfile(self.signature_filepath):
+            os.remove(self.signature_filepath)
+
+    @property
+    def dependencies(self) -> list:
+        return [
+            HPLC(self.project),
+            TissueWeight(self.project),
+            Outliers(self.project),
+            TreatmentInformation(self.project),
+        ]
+
+    @property
+    def dependency_filepaths(self) -> list:
+        return [dependency.filepath for dependency in self.dependencies]
+
+    @property
+    def signature_filepath(self) -> str:
+        return f"{os.path.splitext(self.filepath)[0]}_dependencies.json"
+
+    @property
+    def is_outdated(self) -> bool:
+        if not os.path.isfile(self.signature_filepath):
+            return True
+        with open(self.signature_filepath) as signature_file:
+            return json.load(signature_file) != get_signature(self.dependency_filepaths)
+
+
+def grubbs_test(values, groups, p_value_threshold):
+    """
+    Iterative two sided Grubbs test ran on all groups at once.
+    The most deviant value of each group is rejected while its G statistic exceeds the critical value.
+
+    Args:
+        values (pd.Series): Values to test, null values are ignored
+        groups (pd.Series): Group of each value, same index as values (unique)
+        p_value_threshold (float): Significance level
+
+    Returns:
+        pd.Series: True for rejected values
+    """
+    alpha = float(p_value_threshold)
+    rejected = pd.Series(False, index=values.index)
+    tested = values.notna()
+    while tested.any():
+        grouped = values[tested].groupby(groups[tested], sort=False)
+        deviation = (values[tested] - grouped.transform("mean")).abs()
+        grouped_deviation = deviation.groupby(groups[tested], sort=False)
+        n = grouped.count()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            g = grouped_deviation.max() / grouped.std(ddof=0)
+            t = stats.t.isf(alpha / (2 * n), n - 2)
+            g_critical = (n - 1) / np.sqrt(n) * np.sqrt(t**2 / (n - 2 + t**2))
+        rejecting = g > g_critical
+        if not rejecting.any():
+            break
+        rejected[grouped_deviation.idxmax()[rejecting]] = True
+        # groups without outlier are done
+        tested &= ~rejected & groups.isin(rejecting.index[rejecting])
+    return rejected
+
+
+def iqr_test(values, groups, p_value_threshold=None):
+    """
+    Tukey fences: values further than 1.5 interquartile range from the quartiles of their group.
+    The threshold is not used.
+
+    Args:
+        values (pd.Series): Values to test, null values are ignored
+        groups (pd.Series): Group of each value, same index as values
+        p_value_threshold: Unused, for compatibility with OUTLIER_TESTS
+
+    Returns:
+        pd.Series: True for rejected values
+    """
+    grouped = values.groupby(groups, sort=False)
+    first_quartile = grouped.transform("quantile", 0.25)
+    third_quartile = grouped.transform("quantile", 0.75)
+    fence = 1.5 * (third_quartile - first_quartile)
+    return (values < first_quartile - fence) | (values > third_quartile + fence)
+
+
+def mad_test(values, groups, p_value_threshold=None):
+    """
+    Modified z-score (Iglewicz and Hoaglin): 0.6745 * (value - median) / MAD above 3.5.
+    Groups with a MAD of 0 have no outliers. The threshold is not used.
+
+    Args:
+        values (pd.Series): Values to test, null values are ignored
+        groups (pd.Series): Group of each value, same index as values
+        p_value_threshold: Unused, for compatibility with OUTLIER_TESTS
+
+    Returns:
+        pd.Series: True for rejected values
+    """
+    deviation = (values - values.groupby(groups, sort=False).transform("median")).abs()
+    mad = deviation.groupby(groups, sort=False).transform("median")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        modified_z_score = 0.6745 * deviation / mad
+    return (modified_z_score > 3.5) & (mad > 0)
+
+
+def generalized_esd_test(values, groups, p_value_threshold):
+    """
+    Generalized ESD (Rosner) test with up to half of each group as outliers, ran on all groups at once.
+    The most deviant value is removed up to the maximum number of outliers, the outliers are
+    the values removed before the last step whose R statistic exceeds its critical value.
+
+    Args:
+        values (pd.Series): Values to test, null values are ignored
+        groups (pd.Series): Group of each value, same index as values (unique)
+        p_value_threshold (float): Significance level
+
+    Returns:
+        pd.Series: True for rejected values
+    """
+    alpha = float(p_value_threshold)
+    size = values.groupby(groups, sort=False).count()
+    max_outliers = np.minimum(size // 2, size - 2)
+    removal_step = pd.Series(0, index=values.index)
+    significant_step = pd.Series(0, index=size.index)
+    tested = values.notna() & groups.isin(max_outliers.index[max_outliers > 0])
+    step = 0
+    while tested.any():
+        step += 1
+        grouped = values[tested].groupby(groups[tested], sort=False)
+        deviation = (values[tested] - grouped.transform("mean")).abs()
+        grouped_deviation = deviation.groupby(groups[tested], sort=False)
+        n = size[grouped.count().index]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = grouped_deviation.max() / grouped.std(ddof=1)
+            t = stats.t.ppf(1 - alpha / (2 * (n - step + 1)), n - step - 1)
+            critical_value = (n - step) * t / np.sqrt((n - step - 1 + t**2) * (n - step + 1))
+        significant_step[r.index[r > critical_value]] = step
+        removal_step[grouped_deviation.idxmax()] = step
+        continuing = max_outliers.index[max_outliers > step]
+        tested &= (removal_step == 0) & groups.isin(continuing)
+    return (removal_step > 0) & (removal_step <= groups.map(significant_step))
+
+
+def rout_test(values, groups, p_value_threshold):
+    """
+    ROUT (Motulsky and Brown) for groups of values, the fit is the group median.
+    Residuals are scaled by the robust standard deviation of the residuals (68.27th percentile),
+    outliers are found from the largest residual with the false discovery rate (Q) set by the threshold.
+
+    Args:
+        values (pd.Series): Values to test, null values are ignored
+        groups (pd.Series): Group of each value, same index as values
+        p_value_threshold (float): Q, the false discovery rate
+
+    Returns:
+        pd.Series: True for rejected values
+    """
+    q = float(p_value_threshold)
+    residuals = (values - values.groupby(groups, sort=False).transform("median")).abs()
+    grouped_residuals = residuals.groupby(groups, sort=False)
+    n = grouped_residuals.transform("count")
+    robust_sd = grouped_residuals.transform("quantile", 0.6827) * n / (n - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_values = 2 * stats.t.sf(residuals / robust_sd, n - 1)
+    rank = grouped_residuals.rank(method="first", ascending=False)
+    significant = pd.Series(p_values, index=values.index) < q * (n - (rank - 1)) / n
+    # every value with a residual as large as the smallest significant one is an outlier
+    last_significant_rank = rank.where(significant).groupby(groups, sort=False).transform("max")
+    return rank <= last_significant_rank
+
+
+def label_outliers(data, test, p_value_threshold):
+    """
+    Labels outliers of every (group_id, compound, region) group with an OUTLIER_TESTS test.
+    Groups with less than 3 values are not tested (is_outlier is nan and outlier_status False).
+
+    Args:
+        data (pd.DataFrame): Hplc data
+        test (str): Name of the test in OUTLIER_TESTS
+        p_value_threshold (float): Significance level of the test
+
+    Returns:
+        pd.DataFrame: The data sorted by group with is_outlier and outlier_status columns
+    """
+    groups = data.groupby(["group_id", "compound", "region"], observed=True).ngroup()
+    data = data[groups.to_numpy() >= 0]
+    groups = groups[groups.to_numpy() >= 0]
+    order = np.argsort(groups.to_numpy(), kind="stable")
+    index = data.index[order]
+    data = data.iloc[order].reset_index(drop=True)
+    groups = groups.iloc[order].reset_index(drop=True)
+    # rows with missing information are not tested
+    values = data.value.where((data.value != 0) & data.notna().all(axis=1))
+    is_tested = values.groupby(groups).transform("count") >= 3
+    is_outlier = OUTLIER_TESTS[test](values.where(is_tested), groups, p_value_threshold)
+    is_outlier = is_outlier & values.notna()
+    data["is_outlier"] = pd.Series(is_outlier, dtype=object).where(is_tested)
+    data["outlier_status"] = pd.Series(
+        np.where(is_outlier, "suspected", "normal"), dtype=object
+    ).where(is_tested, False)
+    data.index = index
+    return data
+
+
+# Batched outlier tests: (values, groups, p_value_threshold) -> True for outliers
+OUTLIER_TESTS = {
+    "grubbs": grubbs_test,
+    "iqr": iqr_test,
+    "mad": mad_test,
+    "esd": generalized_esd_test,
+    "rout": rout_test,
+}
+OUTLIER_KEYS = ["compound", "region", "mouse_id", "group_id"]
+# Number of edits of outlier journals written by Outliers.update, keyed on filepath: ((mtime, size), edits)
+JOURNAL_LENGTHS = {}
+
+
+def read_outlier_journal(filepath) -> pd.DataFrame:
+    return pd.read_csv(
+        filepath,
+        keep_default_na=False,
+        float_precision="round_trip",
+        dtype={"compound": str, "region": str, "outlier_status": str},
     )
-    return df
 
 
-OUTLIER_TESTS = {"grubbs": grubbs_test}
+def apply_outlier_journal(data, journal) -> pd.DataFrame:
+    """
+    Overrides the outlier_status of data with the journal edits, the last edit of a row wins.
+    Edits of rows absent from data are ignored.
+    """
+    journal = journal.drop_duplicates(OUTLIER_KEYS, keep="last")
+    index = pd.MultiIndex.from_frame(data[OUTLIER_KEYS].astype(object))
+    positions = index.get_indexer(
+        pd.MultiIndex.from_frame(journal[OUTLIER_KEYS].astype(object))
+    )
+    found = positions >= 0
+    outlier_status = data.outlier_status.astype(object).to_numpy()
+    outlier_status[positions[found]] = journal.outlier_status.to_numpy()[found]
+    data["outlier_status"] = outlier_status
+    return categorize(data)
 
 
 @dataclass(repr=False)
-class Outliers(PickleDataset):
+class Outliers(ProjectDataset):
 
     project: str
     filename: ClassVar[str] = "outliers"
+    journal_limit: ClassVar[int] = 1000
 
     def generate(self):
-        hplc = HPLC(self.project)
+        # in lazy mode hplc only stores compounds, ratio outliers are labelled on read
+        return self.label(HPLC(self.project).df)
+
+    def label(self, data) -> pd.DataFrame:
+        """Labels the outliers of hplc data with the test and threshold of the project"""
         project_information = ProjectInformation(self.project)
-        cases = [
-            (
-                subset_df,
+        return categorize(
+            label_outliers(
+                data,
                 project_information.outlier_test,
                 project_information.p_value_threshold,
             )
-            for _, subset_df in hplc.df.groupby(
-                ["group_id", "compound", "region", "region"]
-            )
-        ]
-        results = parallel_process(
-            cases, get_labeled_df, description="Calculating outliers"
         )
-        return pd.concat(results)
+
+    def save(self, data: pd.DataFrame):
+        super().save(data)
+        # the saved data supersedes manual edits
+        if os.path.isfile(self.journal_filepath):
+            os.remove(self.journal_filepath)
+
+    def load(self, columns=None, filters=None, apply_journal=True, ratio_data=None) -> SelectableDataFrame:
+        """
+        Reads the outliers, manual edits from the journal are applied before columns and filters.
+        In lazy mode the outliers of the ratios selected by filters are labelled on read,
+        from ratio_data if the caller already derived them (see HPLC.derive_ratios).
+        """
+        has_journal = apply_journal and os.path.isfile(self.journal_filepath)
+        if not has_journal and self.stores_ratios:
+            return super().load(columns, filters)
+        data = super().load()
+        if ratio_data is None:
+            ratio_data = HPLC(self.project).derive_ratios((filters or {}).get("compound"))
+        if len(ratio_data):
+            data = concat_categorized([data, self.label(ratio_data)])
+        if has_journal:
+            data = apply_outlier_journal(data, read_outlier_journal(self.journal_filepath))
+        return SelectableDataFrame(project_data(data, columns, filters))
 
     def update(self, updates):
-        data = self.df.set_index(["compound", "region", "mouse_id", "group_id"])
-        updates = updates.set_index(["compound", "region", "mouse_id", "group_id"])
-        data.update(updates[["outlier_status"]])
-        self.save(data.reset_index())
+        """
+        Appends the outlier_status of updates to the journal, compacted every journal_limit edits.
+
+        Args:
+            updates (pd.DataFrame): Rows with compound, region, mouse_id, group_id and outlier_status
+        """
+        edits = updates[[*OUTLIER_KEYS, "outlier_status"]].dropna(subset=["outlier_status"])
+        is_new = not os.path.isfile(self.journal_filepath)
+        journal_length = self.journal_length + len(edits)
+        edits.to_csv(self.journal_filepath, mode="a", header=is_new, index=False)
+        if journal_length > self.journal_limit:
+            self.compact()
+        else:
+            JOURNAL_LENGTHS[self.journal_filepath] = (self.journal_stat, journal_length)
+
+    def compact(self):
+        """
+        Writes the journal edits to the outliers file.
+        Edits of lazy ratios are not stored in the file and stay in the journal.
+        """
+        journal = read_outlier_journal(self.journal_filepath)
+        data = super().load()
+        is_stored = journal.compound.isin(data.compound.astype(str))
+        self.save(apply_outlier_journal(data, journal[is_stored]))
+        if not is_stored.all():
+            journal[~is_stored].to_csv(self.journal_filepath, index=False)
+
+    @property
+    def stores_ratios(self) -> bool:
+        return has_ratios(super().load(columns=["compound"]))
+
+    def delete(self):
+        super().delete()
+        if os.path.isfile(self.journal_filepath):
+            os.remove(self.journal_filepath)
+
+    @property
+    def journal_filepath(self) -> str:
+        return f"{os.path.splitext(self.filepath)[0]}_journal.csv"
+
+    @property
+    def journal_stat(self) -> tuple:
+        stat = os.stat(self.journal_filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def journal_length(self) -> int:
+        """
+        Number of edits in the journal, tracked in JOURNAL_LENGTHS by update.
+        Lines are counted (not parsed) if the journal was written elsewhere.
+        """
+        if not os.path.isfile(self.journal_filepath):
+            return 0
+        stat, journal_length = JOURNAL_LENGTHS.get(self.journal_filepath, (None, None))
+        if stat == self.journal_stat:
+            return journal_length
+        with open(self.journal_filepath, "rb") as journal:
+            # header line
+            return sum(1 for _ in journal) - 1
 
    
 @dataclass 
@@ -267,7 +847,7 @@ class TissueWeight(PickleDataset):
             id_vars=["mouse_id", "group_id"], value_vars=raw_data.columns[2:]
         )
         raw_data["compound"] = "weight"
-        return raw_data.rename(columns={"variable": "region"})
+        return categorize(raw_data.rename(columns={"variable": "region"}))
         
 
 @dataclass
@@ -5,6 +5,12 @@ from typing import ClassVar
 from module.core.utils import is_array_like
 
 
+def read_json(filepath):
+    with open(filepath) as outfile:
+        mapping = json.load(outfile)
+    return mapping
+
+
 @dataclass
 class JSONMapping(Cacheable):
     """Base class for JSON mappings.
@@ -15,13 +21,12 @@ class JSONMapping(Cacheable):
     extension: ClassVar[str] = "json"
 
     def load(self) -> dict:
-        with open(self.filepath) as outfile:
-            mapping = json.load(outfile)
-        return mapping
+        return self.read(read_json)
 
     def save(self, mapping):
         with open(self.filepath, "w") as json_file:
             json.dump(mapping, json_file)
+        self.invalidate_cache()
 
     def add(self, key, value):
         mapping = self.load()
@@ -1,41 +1,417 @@
 from dataclasses import dataclass, field
+from typing import ClassVar
+import copy, pickle, warnings
 import networkx as nx
 import scipy
+from scipy.sparse.csgraph import shortest_path
 import pandas as pd
 import numpy as np
-from module.core.utils import parallel_process
+from statsmodels.stats.multitest import multipletests
+from module.core.Cacheable import Cacheable
+from module.core.utils import parallel_process, get_content_hash, LRUCache
 
 
+def pairwise_ranks(values, mask):
+    """
+    Ranks (average for ties) of each column within the rows it shares with every other column.
+
+    Args:
+        values (np.ndarray): (..., observations, variables) array, NaN for missing values.
+        mask (np.ndarray): Boolean array of the non missing values.
+
+    Returns:
+        np.ndarray: (..., observations, variables, variables) array, [..., :, i, j] ranks column i on the rows
+        where both i and j are present, NaN elsewhere.
+    """
+    shared = mask[..., :, :, None] & mask[..., :, None, :]
+    return scipy.stats.rankdata(
+        np.where(shared, values[..., :, :, None], np.nan), axis=-3, nan_policy="omit"
+    )
 
 
-def calculate_correlation(method, x, y):
-    """Calculate the correlation and p-value based on the specified method."""
+def pairwise_pearson(x, y, shared):
+    """
+    Pearson correlation of x[..., :, i, j] and y[..., :, i, j] over the shared rows, for all pairs at once.
+    """
+    n = shared.sum(axis=-3, keepdims=True)
+    x, y = np.where(shared, x, 0), np.where(shared, y, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.where(shared, x - x.sum(axis=-3, keepdims=True) / n, 0)
+        y = np.where(shared, y - y.sum(axis=-3, keepdims=True) / n, 0)
+        return (x * y).sum(axis=-3) / np.sqrt((x * x).sum(axis=-3) * (y * y).sum(axis=-3))
+
+
+def paired_values(values, method):
+    """
+    Observations of every pair of columns, restricted to the rows where both are present.
+
+    Args:
+        values (np.ndarray): (..., observations, variables) array, NaN for missing values.
+        method (str): 'pearson' (raw values) or 'spearman' (values ranked within each pair).
+
+    Returns:
+        tuple(np.ndarray): (..., observations, variables, variables) arrays x, y and shared,
+        [..., :, i, j] holds the observations of columns i (x) and j (y) and the rows where both are present
+    """
+    mask = ~np.isnan(values)
+    shared = mask[..., :, :, None] & mask[..., :, None, :]
+    x = (
+        pairwise_ranks(values, mask)
+        if method == "spearman"
+        else np.where(shared, values[..., :, :, None], np.nan)
+    )
+    return x, np.swapaxes(x, -1, -2), shared
+
+
+def masked_pearson(values, mask):
+    """
+    Pairwise complete pearson correlations between the columns of stacked (observations, variables) arrays,
+    from masked matrix products: sums of x, x² and xy over the rows shared by each pair.
+    """
+    n = np.swapaxes(mask, -1, -2).astype(int) @ mask
+    # centered to limit cancellation in the sums below, correlations are shift invariant
+    values = np.where(mask, values, 0)
+    values = np.where(
+        mask, values - values.sum(axis=-2, keepdims=True) / np.maximum(mask.sum(axis=-2, keepdims=True), 1), 0
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sums = np.swapaxes(values, -1, -2) @ mask
+        squares = np.swapaxes(values**2, -1, -2) @ mask
+        covariances = np.swapaxes(values, -1, -2) @ values - sums * np.swapaxes(sums, -1, -2) / n
+        variances = squares - sums**2 / n
+        return covariances / np.sqrt(variances * np.swapaxes(variances, -1, -2))
+
+
+def reranked_spearman(values, pairs):
+    """
+    Spearman correlations of the selected pairs of columns, ranked on the rows shared by each pair.
+
+    Args:
+        values (np.ndarray): (..., observations, variables) array, NaN for missing values.
+        pairs (np.ndarray): (..., variables, variables) boolean array of the pairs to correlate.
+
+    Returns:
+        np.ndarray: Correlations of the pairs, in the order of values[pairs]
+    """
+    columns = np.swapaxes(values, -1, -2)
+    *stack, first, second = np.nonzero(pairs)
+    x, y = columns[(*stack, first)], columns[(*stack, second)]
+    shared = ~np.isnan(x) & ~np.isnan(y)
+    x, y = (
+        scipy.stats.rankdata(np.where(shared, column, np.nan), axis=-1, nan_policy="omit")
+        for column in [x, y]
+    )
+    return pairwise_pearson(x.T[:, :, None], y.T[:, :, None], shared.T[:, :, None])[:, 0]
+
+
+def batch_correlations(values, method):
+    """
+    Pairwise complete pearson or spearman correlations between the columns of stacked
+    (observations, variables) arrays.
+    Spearman correlates the ranks of the columns with masked_pearson, only the pairs where a column
+    has observations that the other lacks are ranked again on their shared rows.
+
+    Args:
+        values (np.ndarray): (..., observations, variables) array, NaN for missing values.
+        method (str): 'pearson' or 'spearman'.
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): (..., variables, variables) correlations and number of shared observations
+    """
+    mask = ~np.isnan(values)
+    n = np.swapaxes(mask, -1, -2).astype(int) @ mask
     if method == "pearson":
-        result = scipy.stats.pearsonr(x, y)
-        return result.statistic, result.pvalue
+        correlations = masked_pearson(values, mask)
     elif method == "spearman":
-        result = scipy.stats.spearmanr(x, y)
-        return result.correlation, result.pvalue
-    elif method == "kendall":
-        result = scipy.stats.kendalltau(x, y)
-        return result.correlation, result.pvalue
+        correlations = masked_pearson(scipy.stats.rankdata(values, axis=-2, nan_policy="omit"), mask)
+        counts = mask.sum(axis=-2)
+        reranked = (n != counts[..., :, None]) | (n != counts[..., None, :])
+        if reranked.any():
+            correlations[reranked] = reranked_spearman(values, reranked)
     else:
         raise ValueError(f"Unknown method: {method}")
+    return correlations, n
+
+
+# Exact null distributions of kendall's tau (cumulative, by number of discordant pairs), by number of observations
+KENDALL_EXACT_CDFS = LRUCache(maxsize=128)
+
+
+def kendall_exact_cdf(n):
+    """
+    Cumulative distribution of the number of discordant pairs of n observations without ties
+    (the number of inversions of a random permutation), used for exact kendall p-values.
+    """
+    if n not in KENDALL_EXACT_CDFS:
+        distribution = np.ones(1)
+        for size in range(2, n + 1):
+            distribution = np.convolve(distribution, np.ones(size)) / size
+        KENDALL_EXACT_CDFS[n] = np.cumsum(distribution)
+    return KENDALL_EXACT_CDFS[n]
+
+
+# Largest inputs of the batched kendall: elements of each sign matrix (observations² * variables)
+# and multiply-adds of the products (observations² * variables²), larger inputs are correlated pair by pair
+KENDALL_BATCH_ELEMENTS = 2**22
+KENDALL_BATCH_OPERATIONS = 2**30
+
 
+def kendall_correlations(values):
+    """
+    Pairwise complete kendall tau-b correlations and two sided p-values between all the columns of a
+    (observations, variables) array at once, as scipy.stats.kendalltau: exact p-values without ties
+    and up to 33 observations, the normal approximation with the tie corrected variance otherwise.
+    Concordant minus discordant pairs and ties are counted with products of the sign matrices of the
+    pairwise differences of each column: O(observations² * variables) memory and
+    O(observations² * variables²) time. Above KENDALL_BATCH_ELEMENTS or KENDALL_BATCH_OPERATIONS
+    the pairs are correlated one by one with the sort based scipy implementation (see pairwise_kendall).
 
-def correlate(method, return_type):
-    """Return a correlation function based on the specified method, p-value threshold, and return type."""
+    Args:
+        values (np.ndarray): (observations, variables) array, NaN for missing values.
 
-    def executor(x, y):
-        correlation, pvalue = calculate_correlation(method, x, y)
-        if return_type == "pvalues":
-            return pvalue
-        elif return_type == "correlations":
-            return correlation
+    Returns:
+        tuple(np.ndarray, np.ndarray): (variables, variables) correlations and p-values
+    """
+    observations, variables = values.shape
+    if (
+        observations**2 * variables > KENDALL_BATCH_ELEMENTS
+        or observations**2 * variables**2 > KENDALL_BATCH_OPERATIONS
+    ):
+        return pairwise_kendall(values)
+    mask = ~np.isnan(values)
+    n = mask.T.astype(int) @ mask
+    # [k, l, i]: sign of the difference of rows k and l in column i, whether both are present and tied
+    present = (mask[:, None, :] & mask[None, :, :]).astype(float)
+    signs = np.nan_to_num(np.sign(values[:, None, :] - values[None, :, :]))
+    ties = present * (signs == 0)
+    # observations tied with each observation (itself included) in column i, on the rows shared with j
+    tie_counts = np.einsum("kli,klj->kij", ties, present)
+    shared = mask[:, :, None] & mask[:, None, :]
+    concordance = np.einsum("kli,klj->ij", signs, signs) / 2
+    total = n * (n - 1) / 2
+    x_ties = (tie_counts.sum(axis=0) - n) / 2
+    y_ties = x_ties.T
+    joint_ties = (np.einsum("kli,klj->ij", ties, ties) - n) / 2
+    discordant = (total - x_ties - y_ties + joint_ties - concordance) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlations = np.clip(concordance / np.sqrt(total - x_ties) / np.sqrt(total - y_ties), -1, 1)
+        x0 = np.where(shared, (tie_counts - 1) * (tie_counts - 2), 0).sum(axis=0)
+        x1 = np.where(shared, (tie_counts - 1) * (2 * tie_counts + 5), 0).sum(axis=0)
+        m = n * (n - 1.0)
+        variances = (
+            (m * (2 * n + 5) - x1 - x1.T) / 18
+            + (2 * x_ties * y_ties) / m
+            + x0 * x0.T / (9 * m * (n - 2))
+        )
+        pvalues = 2 * scipy.stats.norm.sf(np.abs(concordance) / np.sqrt(variances))
+    extreme = np.minimum(discordant, total - discordant)
+    is_exact = (x_ties == 0) & (y_ties == 0) & ((n <= 33) | (extreme <= 1)) & (n > 0)
+    for size in np.unique(n[is_exact]):
+        pairs = is_exact & (n == size)
+        pvalues[pairs] = np.minimum(
+            1, 2 * kendall_exact_cdf(size)[np.rint(extreme[pairs]).astype(int)]
+        )
+    untied = (x_ties < total) & (y_ties < total)
+    correlations[~untied], pvalues[~untied] = np.nan, np.nan
+    return correlations, pvalues
+
+
+def pairwise_kendall(values):
+    """
+    kendall_correlations with scipy.stats.kendalltau on the shared observations of each pair,
+    O(observations * log(observations)) per pair and no large intermediate arrays.
+    """
+    mask = ~np.isnan(values)
+    variables = values.shape[1]
+    correlations = np.full((variables, variables), np.nan)
+    pvalues = np.full((variables, variables), np.nan)
+    for i in range(variables):
+        for j in range(i, variables):
+            shared = mask[:, i] & mask[:, j]
+            if shared.sum() < 2:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # constant input
+                result = scipy.stats.kendalltau(values[shared, i], values[shared, j])
+            correlations[i, j] = correlations[j, i] = result.statistic
+            pvalues[i, j] = pvalues[j, i] = result.pvalue
+    return correlations, pvalues
+
+
+def correlation_pvalues(correlations, n):
+    """
+    Two sided p-values of correlation coefficients from the t distribution with n - 2 degrees of freedom
+    (as scipy.stats.pearsonr and spearmanr).
+    """
+    correlations = np.clip(correlations, -1, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.abs(correlations) * np.sqrt((n - 2) / (1 - correlations**2))
+    return np.where(
+        np.abs(correlations) == 1, 0.0, 2 * scipy.stats.t.sf(t, n - 2)
+    )
+
+
+def correlation_matrix(pivot, method, min_periods=1):
+    """
+    Pairwise complete correlations of the columns of a pivot, like DataFrame.corr, computed for all pairs
+    at once instead of calling scipy on each pair (see batch_correlations and kendall_correlations).
+    As DataFrame.corr with a callable, pairs with less than min_periods shared observations are NaN
+    and the diagonal is 1.
+
+    Args:
+        pivot (pd.DataFrame): Observations as rows, variables as columns.
+        method (str): 'pearson', 'spearman' or 'kendall'.
+        min_periods (int, optional): Minimum number of shared observations. Defaults to 1.
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame, pd.DataFrame): correlations, pvalues and number of shared observations
+    """
+    values = pivot.to_numpy(dtype=float)
+    if method == "kendall":
+        mask = ~np.isnan(values)
+        n = mask.T.astype(int) @ mask
+        correlations, pvalues = kendall_correlations(values)
+    else:
+        correlations, n = batch_correlations(values, method)
+        pvalues = correlation_pvalues(correlations, n)
+    np.fill_diagonal(correlations, 1)
+    np.fill_diagonal(pvalues, 1)
+    insufficient = n < min_periods
+    correlations[insufficient], pvalues[insufficient] = np.nan, np.nan
+    return tuple(
+        pd.DataFrame(result, index=pivot.columns, columns=pivot.columns)
+        for result in [correlations, pvalues, n]
+    )
+
+
+RESAMPLINGS = {"permutation", "bootstrap"}
+# Bounds the size of the arrays of a chunk of resamples (resamples x observations x variables²)
+RESAMPLING_CHUNK_ELEMENTS = 2**22
+
+
+def resample_chunk(case):
+    """
+    Correlates a chunk of resamples of values, see resampled_pvalues.
+
+    Args:
+        case (tuple): values, method, resampling, number of resamples, min_periods, observed correlations and seed
+
+    Returns:
+        tuple(np.ndarray): For each pair, the number of valid resamples and either the number of resamples
+        at least as extreme as observed (permutation) or the numbers of resamples <= 0 and >= 0 (bootstrap)
+    """
+    values, method, resampling, n_resamples, min_periods, observed, seed = case
+    rng = np.random.default_rng(seed)
+    if resampling == "permutation":
+        # the observations of y are shuffled within the rows shared by each pair:
+        # shared rows sorted by random keys are put back in the shared positions
+        x, y, shared = paired_values(values, method)
+        keys = np.where(shared, rng.random((n_resamples, *shared.shape)), np.inf)
+        order = np.argsort(keys, axis=1)
+        positions = np.broadcast_to(np.argsort(~shared, axis=0, kind="stable"), order.shape)
+        permuted = np.empty(order.shape)
+        np.put_along_axis(
+            permuted, positions, np.take_along_axis(np.broadcast_to(y, order.shape), order, axis=1), axis=1
+        )
+        correlations = pairwise_pearson(x, permuted, shared)
+        valid = ~np.isnan(correlations) & (shared.sum(axis=0) >= min_periods)
+        # tolerance for resamples that reproduce the observed pairing
+        is_extreme = np.abs(correlations) >= np.abs(observed) - 1e-12
+        return valid.sum(axis=0), (valid & is_extreme).sum(axis=0)
+    resamples = values[rng.integers(0, len(values), (n_resamples, len(values)))]
+    correlations, n = batch_correlations(resamples, method)
+    valid = ~np.isnan(correlations) & (n >= min_periods)
+    return valid.sum(axis=0), (valid & (correlations <= 0)).sum(axis=0), (valid & (correlations >= 0)).sum(axis=0)
+
+
+def resampled_pvalues(
+    pivot, method, resampling, n_resamples=1000, min_periods=1, seed=None, backend="serial"
+):
+    """
+    Two sided p-values of the correlations between the columns of a pivot, from resampling its rows (mice)
+    instead of the t distribution.
+    Permutation shuffles the rows shared by each pair of columns:
+    p = (1 + resamples with |r| >= |observed r|) / (1 + resamples).
+    Bootstrap draws rows with replacement: p = twice the fraction of resampled correlations beyond 0 (percentile test).
+    Resamples where a pair has less than min_periods shared observations or a constant column are ignored.
+    Resamples are correlated in chunks of batched array operations, with a seed the p-values
+    are reproducible whatever the backend.
+
+    Args:
+        pivot (pd.DataFrame): Observations as rows, variables as columns.
+        method (str): 'pearson' or 'spearman'.
+        resampling (str): 'permutation' or 'bootstrap'.
+        n_resamples (int, optional): Number of resamples. Defaults to 1000.
+        min_periods (int, optional): Minimum number of shared observations. Defaults to 1.
+        seed (int, optional): Seed of the random generator. Defaults to None (not reproducible).
+        backend (str, optional): parallel_process backend for the chunks. Defaults to "serial",
+            'process' can't be used when the matrix is itself executed in a process pool.
+
+    Returns:
+        pd.DataFrame: p-values, the diagonal is 1
+    """
+    if resampling not in RESAMPLINGS:
+        raise ValueError(f"Unknown resampling: {resampling}, possible resamplings are {list(RESAMPLINGS)}")
+    if method not in ["pearson", "spearman"]:
+        raise ValueError(f"Resampling is not available for {method} correlations")
+    values = pivot.to_numpy(dtype=float)
+    observed, n = batch_correlations(values, method)
+    n_rows, n_columns = values.shape
+    chunk_size = max(1, RESAMPLING_CHUNK_ELEMENTS // (n_rows * n_columns**2))
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    cases = [
+        (values, method, resampling, size, min_periods, observed, chunk_seed)
+        for size, chunk_seed in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes)))
+    ]
+    counts = [
+        sum(chunk_counts)
+        for chunk_counts in zip(
+            *parallel_process(cases, executor=resample_chunk, description=f"{resampling.capitalize()} resampling", backend=backend)
+        )
+    ]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if resampling == "permutation":
+            pvalues = (1 + counts[1]) / (1 + counts[0])
         else:
-            raise ValueError(f"Unknown return type: {return_type}")
+            pvalues = np.minimum(1, 2 * np.minimum(counts[1], counts[2]) / counts[0])
+    pvalues[(counts[0] == 0) | (n < min_periods)] = np.nan
+    np.fill_diagonal(pvalues, 1)
+    return pd.DataFrame(pvalues, index=pivot.columns, columns=pivot.columns)
 
-    return executor
+
+# Multiple comparison corrections of Matrix, mapped to their statsmodels multipletests method
+CORRECTIONS = {"bh": "fdr_bh", "bonferroni": "bonferroni", "holm": "holm"}
+
+
+def correct_pvalues(pvalues, correction, lower_triangle=False):
+    """
+    Corrects a matrix of p-values for multiple comparisons, all tests of the matrix at once.
+    For symmetric matrices (self correlation), only the lower triangle holds distinct tests,
+    corrected p-values are mirrored to the upper triangle and the diagonal is kept.
+
+    Args:
+        pvalues (pd.DataFrame): Matrix of p-values, NaN for untested pairs.
+        correction (str): 'bh' (Benjamini-Hochberg), 'bonferroni' or 'holm', None for no correction.
+        lower_triangle (bool, optional): Whether only the lower triangle are tests. Defaults to False.
+
+    Returns:
+        pd.DataFrame: Corrected p-values
+    """
+    if correction is None:
+        return pvalues.copy()
+    if correction not in CORRECTIONS:
+        raise ValueError(f"Unknown correction: {correction}, possible corrections are {list(CORRECTIONS)}")
+    values = pvalues.to_numpy(dtype=float)
+    tested = ~np.isnan(values)
+    if lower_triangle:
+        tested &= np.tri(*values.shape, k=-1, dtype=bool)
+    corrected = np.full(values.shape, np.nan)
+    if tested.any():
+        corrected[tested] = multipletests(values[tested], method=CORRECTIONS[correction])[1]
+    if lower_triangle:
+        corrected = np.where(tested, corrected, corrected.T)
+        np.fill_diagonal(corrected, np.diag(values))
+    return pd.DataFrame(corrected, index=pvalues.index, columns=pvalues.columns)
 
 
 @dataclass
@@ -53,6 +429,13 @@ class Matrix:
         n_minimum (int): Minumum occurnces of overlapping var1 and var2 to be correlated. Default = 5.
         method (str): Correlation method ('pearson', 'spearman', 'kendall'). Default = "pearson".
         pvalue_threshold (float): Threshold for significance in correlation. Defult = 0.05
+        significance (str): How p-values are calculated ('parametric', 'permutation', 'bootstrap'),
+            see resampled_pvalues. Default = "parametric".
+        n_resamples (int): Number of permutations or bootstrap resamples. Default = 1000.
+        seed (int): Seed of the resampling. Default = None.
+        resampling_backend (str): parallel_process backend of the resampling. Default = "serial".
+        correction (str): Multiple comparison correction of the p-values ('bh', 'bonferroni', 'holm'),
+            see correct_pvalues. Default = None.
 
     Returns:
         filtered_data (pd.DataFrame): Subselected data filtered based on n_minimum between vairables.
@@ -60,12 +443,14 @@ class Matrix:
         corr_masked (pd.DataFrame): Masked correlation matrix based on p-value threshold.
         correlations (pd.DataFrame): Full correlation matrix.
         pvalues (pd.DataFrame): Matrix of p-values for the correlations.
+        corrected_pvalues (pd.DataFrame): p-values corrected for multiple comparisons, used for corr_masked.
+        overlap (pd.DataFrame): Matrix of the number of observations shared by each pair.
         missing_values (list): List of variables with missing data (< n_minimum).
         missing_overlap (list): List of variable pairs with insufficient data overlap.
 
     """
 
-    data: pd.DataFrame
+    data: pd.DataFrame = field(repr=False)
     grouping: str
     between: str
     var1: str
@@ -75,6 +460,11 @@ class Matrix:
     n_minimum: int = 5
     method: str = "pearson"
     pvalue_threshold: float = 0.05
+    significance: str = field(default="parametric", kw_only=True)
+    n_resamples: int = field(default=1000, kw_only=True)
+    seed: int = field(default=None, kw_only=True)
+    resampling_backend: str = field(default="serial", kw_only=True)
+    correction: str = field(default=None, kw_only=True)
     delay_execution: bool = field(default=True, kw_only=True)
 
     filtered_data: pd.DataFrame = field(init=False)
@@ -82,6 +472,8 @@ class Matrix:
     corr_masked: pd.DataFrame = field(init=False)
     correlations: pd.DataFrame = field(init=False)
     pvalues: pd.DataFrame = field(init=False)
+    corrected_pvalues: pd.DataFrame = field(init=False)
+    overlap: pd.DataFrame = field(init=False)
     missing_values: list = field(init=False)
     missing_overlap: list = field(init=False)
     
@@ -119,7 +511,7 @@ class Matrix:
         """
         self.missing_values = []
         missing_indices = []
-        for col, df in self.data.groupby(by=[self.between, self.accross]):
+        for col, df in self.data.groupby(by=[self.between, self.accross], observed=True):
             if df.value.notna().sum() < self.n_minimum:
                 self.missing_values.append(col)
                 missing_indices.extend(df.index)
@@ -137,6 +529,7 @@ class Matrix:
             values="value",
             index=self.filtered_data["mouse_id"],
             columns=[self.between, self.accross],
+            observed=True,
         )
 
     def order_columns(self):
@@ -157,27 +550,32 @@ class Matrix:
         
     def correlate(self):
         """
-        Calculates and stores correlation and p-value matrices.
+        Calculates the correlation, p-value and overlap matrices in a single pass (see correlation_matrix).
+        p-values are replaced by resampled ones unless significance is parametric,
+        corr_masked keeps the correlations significant after correction.
         """
-        self.pvalues = self.create_corr_matrix('pvalues')
-        self.correlations = self.create_corr_matrix('correlations')
-        self.corr_masked = self.correlations[self.pvalues < self.pvalue_threshold]
-        
-
-    def create_corr_matrix(self, result_type):
-        """
-        Creates a correlation matrix for either correlation values or p-values.
-
-        Args:
-            result_type (str): Type of result to return ('pvalues' or 'correlations').
-
-        Returns:
-            pd.DataFrame: A DataFrame containing the requested correlation matrix.
-        """
-        method = correlate(self.method, result_type)
-        return self.pivot.corr(method=method, min_periods=self.n_minimum).loc[
-            tuple([self.var1, self.var2])
-        ]
+        correlations, pvalues, overlap = correlation_matrix(
+            self.pivot, self.method, self.n_minimum
+        )
+        if self.significance != "parametric":
+            resampled = resampled_pvalues(
+                self.pivot,
+                self.method,
+                self.significance,
+                self.n_resamples,
+                self.n_minimum,
+                self.seed,
+                self.resampling_backend,
+            )
+            pvalues = resampled.where(pvalues.notna())
+        block = tuple([self.var1, self.var2])
+        self.correlations = correlations.loc[block]
+        self.pvalues = pvalues.loc[block]
+        self.overlap = overlap.loc[block]
+        self.corrected_pvalues = correct_pvalues(
+            self.pvalues, self.correction, lower_triangle=not self.is_square
+        )
+        self.corr_masked = self.correlations[self.corrected_pvalues < self.pvalue_threshold]
 
     def find_missing_overlap(self):
         """
@@ -185,8 +583,8 @@ class Matrix:
         """
         self.missing_overlap = [
             ((self.var1, index), (self.var2, column))
-            for (index, column), is_na in self.correlations.T.isna().stack().items()
-            if is_na
+            for (index, column), is_missing in (self.overlap.T < self.n_minimum).stack().items()
+            if is_missing
         ]
         if self.missing_overlap:
             print(
@@ -203,13 +601,129 @@ class Matrix:
             self.corr_masked[mask] = np.nan
             np.fill_diagonal(self.corr_masked.values, 1)
 
+def get_matrix_hash(matrix) -> str:
+    """
+    Content hash of a delayed matrix: the data its pivot is built from and the matrix settings.
+    """
+    data = matrix.data[["mouse_id", matrix.between, matrix.accross, "value"]]
+    settings = (
+        matrix.grouping,
+        matrix.between,
+        matrix.var1,
+        matrix.var2,
+        matrix.accross,
+        matrix.order,
+        matrix.n_minimum,
+        matrix.method,
+        matrix.pvalue_threshold,
+        matrix.significance,
+        matrix.n_resamples,
+        matrix.seed,
+        matrix.correction,
+    )
+    return get_content_hash(data, settings)
+
+
+# Process wide memo of executed matrices, keyed on matrix hash, shared by all matrix figures
+MATRIX_CACHE = LRUCache(maxsize=256)
+
+
+def calculate_matrices(matrices, store=None, backend=None) -> list[Matrix]:
+    """
+    Executes the delayed matrices that are not in MATRIX_CACHE (by matrix hash) in parallel.
+    Returned matrices are shallow copies, their attributes can be reassigned but not modified in place.
+
+    Args:
+        matrices (list[Matrix]): Matrices created with delay_execution
+        store (MatrixStore, optional): Persisted matrices, read before and updated after calculation. Defaults to None.
+        backend (str, optional): parallel_process backend. Defaults to None (see get_backend).
+
+    Returns:
+        list[Matrix]: The executed matrices, in the same order
+    """
+    matrix_hashes = [get_matrix_hash(matrix) for matrix in matrices]
+    stored = store.load() if store is not None else {}
+    available = {
+        matrix_hash: MATRIX_CACHE[matrix_hash] if matrix_hash in MATRIX_CACHE else stored[matrix_hash]
+        for matrix_hash in matrix_hashes
+        if matrix_hash in MATRIX_CACHE or matrix_hash in stored
+    }
+    missing = {
+        matrix_hash: matrix
+        for matrix, matrix_hash in zip(matrices, matrix_hashes)
+        if matrix_hash not in available
+    }
+    calculated = (
+        dict(zip(missing, parallel_process(list(missing.values()), description="Creating matrices", backend=backend)))
+        if missing
+        else {}
+    )
+    for matrix_hash, matrix in {**available, **calculated}.items():
+        MATRIX_CACHE[matrix_hash] = matrix
+    if store is not None and calculated:
+        store.update(calculated)
+    return [copy.copy({**available, **calculated}[matrix_hash]) for matrix_hash in matrix_hashes]
+
+
+@dataclass
+class MatrixStore(Cacheable):
+    """
+    Executed matrices of a project (or experiment) persisted by matrix hash, see calculate_matrices.
+    Loaded matrices are shared with LOAD_CACHE (not copied) and must not be modified.
+    """
+
+    project: str
+    experiment: str = None
+    filename: ClassVar[str] = "matrices"
+    extension: ClassVar[str] = "pkl"
+
+    def generate(self):
+        return {}
+
+    def save(self, matrices: dict):
+        with open(self.filepath, "wb") as file:
+            pickle.dump(matrices, file)
+        self.invalidate_cache()
+
+    def load(self) -> dict:
+        return self.read(pd.read_pickle, shared=True)
+
+    def update(self, matrices: dict):
+        self.save({**self.load(), **matrices})
+
+
+def get_efficiency(distances):
+    """Mean inverse distance between distinct nodes, 0 without at least 2 nodes"""
+    n_nodes = len(distances)
+    if n_nodes < 2:
+        return 0
+    with np.errstate(divide="ignore"):
+        inverse_distances = 1 / distances
+    np.fill_diagonal(inverse_distances, 0)
+    return float(inverse_distances.sum() / (n_nodes * (n_nodes - 1)))
+
+
+def get_path_length(distances):
+    """Mean distance between distinct nodes, None if a node can't be reached"""
+    n_nodes = len(distances)
+    if np.isinf(distances).any():
+        return None
+    return float(distances.sum() / (n_nodes * (n_nodes - 1))) if n_nodes > 1 else 0
+
+
 @dataclass
 class Network:
     """
     A class to represent a network/graph constructed from a correlation matrix.
 
+    The graph is stored as arrays over its nodes (adjacency and signed weights), metrics are matrix operations
+    and the networkx graph G is only built when accessed (ex: for drawing).
+
     Attributes:
     matrix (Matrix): An instance of the Matrix class containing the data and correlation matrix.
+    nodes (list): Node labels, the order of the rows/columns of adjacency and weights.
+    adjacency (np.ndarray): adjacency[i, j] is True if there is an edge i -> j (both ways if undirected).
+    weights (np.ndarray): Correlation of each edge, 0 where there is none.
 
     Methods:
     max_node_degree(): Returns the maximum degree of the nodes in the graph.
@@ -233,26 +747,28 @@ class Network:
             self.delay_execution = False
         else:
             self.is_directed = self.matrix.is_square
-            self.G = nx.MultiDiGraph() if self.matrix.is_square else nx.Graph()
             # directed edge -  to_correlate[0] --> to_correlate[1]
-            self.G.clear()
-
-            self.G.add_nodes_from(
-                self.matrix.corr_masked.columns.tolist()
-            )  # adds every BR as a node
-            self.edge_labels = {}
-            for (row, col), correlation in self.matrix.corr_masked.stack().dropna().items():
-                # Add edge to the graph with edge weight and color
-                # Avoid self sorrelation
-                if not(row == col and not self.is_directed):
-                    self.G.add_edge(
-                        row,
-                        col,
-                        weight=abs(correlation),
-                        color="red" if correlation > 0 else "blue",
-                    )
-                    
-                    self.edge_labels[(row, col)] = f"{correlation:.2f}"
+            corr_masked = self.matrix.corr_masked
+            rows, columns = np.nonzero(corr_masked.notna().to_numpy())
+            correlations = corr_masked.to_numpy()[rows, columns]
+            rows, columns = corr_masked.index[rows], corr_masked.columns[columns]
+            # Avoid self sorrelation
+            is_edge = (rows != columns) | self.is_directed
+            self.edges = list(zip(rows[is_edge], columns[is_edge], correlations[is_edge]))
+            self.edge_labels = {
+                (row, col): f"{correlation:.2f}" for row, col, correlation in self.edges
+            }
+            # every BR is a node
+            self.nodes = list(dict.fromkeys([*corr_masked.columns, *rows[is_edge]]))
+            positions = {node: i for i, node in enumerate(self.nodes)}
+            self.adjacency = np.zeros((len(self.nodes), len(self.nodes)), dtype=bool)
+            self.weights = np.zeros(self.adjacency.shape)
+            for sources, targets in [[rows, columns]] + ([] if self.is_directed else [[columns, rows]]):
+                sources = [positions[node] for node in sources[is_edge]]
+                targets = [positions[node] for node in targets[is_edge]]
+                self.adjacency[sources, targets] = True
+                self.weights[sources, targets] = correlations[is_edge]
+            self._G = None
 
             angles = np.linspace(
                 0, 2 * np.pi, len(self.matrix.corr_masked.columns), endpoint=False
@@ -266,16 +782,38 @@ class Network:
             self.density = self.calculate_graph_density()
             self.max_degree, self.average_degree = self.calculate_node_degree()
             self.avg_clust_coeff_unweighted, self.avg_clust_coeff_weighted = self.calculate_clustering_coefficient()
-
-            # self.local_efficiency = self.calculate_local_efficiency()
-            # self.global_efficiency = self.calculate_global_efficiency()
-            # self.characteristic_path_length = self.calculate_characteristic_path_length()
+            self.local_eff_unweighted, self.local_eff_weighted = self.calculate_local_efficiency()
+            self.global_eff_unweighted, self.global_eff_weighted = self.calculate_global_efficiency()
+            self.path_length_unweighted, self.path_length_weighted = self.calculate_characteristic_path_length()
 
     def get_title(self):
         """Generates a formatted title for the network graph."""
         title = self.matrix.get_title()
         return title.replace('-', '->') if self.is_directed else title
     
+    @property
+    def G(self):
+        """
+        networkx graph of the network, built on first access: edges are weighted with the absolute
+        correlation and colored red (positive) or blue (negative).
+        """
+        if self._G is None:
+            self._G = nx.MultiDiGraph() if self.is_directed else nx.Graph()
+            self._G.add_nodes_from(self.nodes)
+            for row, col, correlation in self.edges:
+                self._G.add_edge(
+                    row,
+                    col,
+                    weight=abs(correlation),
+                    color="red" if correlation > 0 else "blue",
+                )
+        return self._G
+
+    @property
+    def edge_mask(self):
+        """Adjacency with each edge counted once (upper triangle for undirected networks)"""
+        return self.adjacency if self.is_directed else np.triu(self.adjacency)
+
     def edge_count(self):
         """
         Returns the total number of edges, positive edges, and negative edges in the graph.
@@ -285,141 +823,136 @@ class Network:
             pos_edges (int): The number of edges with positive weights.
             neg_edges (int): The number of edges with negative weights.
         """
-        total_edges = self.G.number_of_edges()
-        pos_edges = 0
-        neg_edges = 0
-
-        for u, v, data in self.G.edges(data=True):
-            color = data.get('color')  
-            if color == 'red':
-                pos_edges += 1
-            elif color == 'blue':
-                neg_edges += 1
+        total_edges = int(self.edge_mask.sum())
+        pos_edges = int((self.edge_mask & (self.weights > 0)).sum())
+        neg_edges = total_edges - pos_edges
         return total_edges, pos_edges, neg_edges
-    
+
     def calculate_node_degree(self):
         """
         Returns:
           max_degree(int): the maximum degree of the nodes in the graph.
         """
         # Calculate degrees for all nodes and find the maximum and mean
-        degrees = dict(self.G.degree())
-        max_degree = max(degrees.values())
-        average_degree = np.mean(list(degrees.values()))
+        degrees = self.degrees
+        max_degree = int(degrees.max())
+        average_degree = np.mean(degrees)
         return max_degree, average_degree
 
+    @property
+    def degrees(self):
+        """Degree of each node, in + out for directed networks (self loops count twice)"""
+        if self.is_directed:
+            return self.adjacency.sum(axis=0) + self.adjacency.sum(axis=1)
+        return self.adjacency.sum(axis=1)
 
     def calculate_graph_density(self):
         """
         Returns:
            graph_density (float): The density of the graph; edges/all_possible_edges.
         """
-        num_edges = self.G.number_of_edges()
-        num_nodes = self.G.number_of_nodes()
+        num_edges = self.edge_mask.sum()
+        num_nodes = len(self.nodes)
 
         if self.is_directed: #directed graph have doubble possible edges
             max_edges = num_nodes * (num_nodes - 1)
         else:
             max_edges = num_nodes * (num_nodes - 1) / 2
         return num_edges / max_edges if max_edges > 0 else 0
-    
 
-    
     def calculate_clustering_coefficient(self):
         """
-        Calculates the average unweighted and weighted clustering coefficients for the graph.
+        Calculates the average unweighted and weighted clustering coefficients for the graph,
+        from the closed walks of length 3 of the adjacency (as nx.clustering): the weighted coefficient
+        uses the cube roots of the weights normalized by the maximum weight (geometric mean of the triangle weights).
 
         Returns:
             avg_clust_coeff_unweighted (float): The average unweighted clustering coefficient of the graph.
             avg_clust_coeff_weighted (float): The average weighted clustering coefficient of the graph.
         """
-        if self.is_directed:
-            # For directed graphs, use nx.clustering with 'directed' and 'weight' parameters
-            clust_coeff_unweighted = None #nx.clustering(self.G.to_undirected(), weight=None)  # Unweighted
-            clust_coeff_weighted = None #nx.clustering(self.G.to_undirected(), weight='weight')  # Weighted
-        else:
-            # For undirected graphs, use nx.clustering without 'directed' parameter
-            clust_coeff_unweighted = nx.clustering(self.G)  # Unweighted
-            clust_coeff_weighted = nx.clustering(self.G, weight='weight')  # Weighted
+        if self.is_directed or not self.nodes:
+            # clustering of directed networks is not calculated
+            return 0, 0
+        degrees = self.degrees
+        possible_triangles = degrees * (degrees - 1)
+        adjacency = self.adjacency.astype(float)
+        weights = np.abs(self.weights)
+        weights = np.cbrt(weights / weights.max()) if weights.any() else weights
+        coefficients = [
+            np.divide(
+                np.einsum("ij,jk,ki->i", matrix, matrix, matrix),
+                possible_triangles,
+                out=np.zeros(len(degrees)),
+                where=possible_triangles > 0,
+            )
+            for matrix in [adjacency, weights]
+        ]
+        avg_clust_coeff_unweighted, avg_clust_coeff_weighted = (
+            float(np.mean(clust_coeff)) for clust_coeff in coefficients
+        )
+        return avg_clust_coeff_unweighted, avg_clust_coeff_weighted
+
+    @property
+    def lengths(self):
+        """
+        Unweighted (1 per edge) and weighted edge lengths, for shortest paths.
+        Weighted lengths are inverted weights: strong correlations are short edges. 0 where there is no edge.
+        """
+        adjacency = self.adjacency & ~np.eye(len(self.nodes), dtype=bool)
+        weights = np.abs(self.weights)
+        with np.errstate(divide="ignore"):
+            return adjacency.astype(float), np.where(adjacency & (weights > 0), 1 / weights, 0)
 
-        avg_clust_coeff_unweighted = sum(clust_coeff_unweighted.values()) / len(clust_coeff_unweighted) if clust_coeff_unweighted else 0
-        avg_clust_coeff_weighted = sum(clust_coeff_weighted.values()) / len(clust_coeff_weighted) if clust_coeff_weighted else 0
+    def calculate_local_efficiency(self):
+        """
+        Local efficiency of a node is the global efficiency of the subgraph of its neighbors
+        (predecessors and successors for directed networks).
 
-        return avg_clust_coeff_unweighted, avg_clust_coeff_weighted
-    
-    # def calculate_local_efficiency(self):
-    #     """
-    #     Returns:
-    #         avg_local_eff_unweighted (float):  average unweighted local efficiency for i nodes.
-    #         avg_local_eff_weighted (float):  average weighted local efficiency for i nodes.
-    #     """
-    #     local_eff_unweighted = 0
-    #     local_eff_weighted = 0
-    #     total_nodes = len(self.G.nodes())
-
-    #     for node in self.G.nodes():
-    #         # Determine neighbors for directed and undirected graphs
-    #         if self.is_directed:
-    #             neighbors = list(set(nx.predecessors(self.G, node)) | set(nx.successors(self.G, node)))
-    #         else:
-    #             neighbors = list(nx.neighbors(self.G, node))
-
-    #         if len(neighbors) > 1:
-    #             subgraph = self.G.subgraph(neighbors)
-    #             # Calculate unweighted local efficiency
-    #             local_eff_unweighted += nx.global_efficiency(subgraph)
-
-    #             # Calculate weighted local efficiency
-    #             # Ensure weights are considered in the subgraph efficiency calculation
-    #             local_eff_weighted += nx.global_efficiency(subgraph, weight='weight')
-
-    #     # Calculate average efficiencies
-    #     avg_local_eff_unweighted = local_eff_unweighted / total_nodes if total_nodes > 0 else 0
-    #     avg_local_eff_weighted = local_eff_weighted / total_nodes if total_nodes > 0 else 0
-    #     return avg_local_eff_unweighted, avg_local_eff_weighted
-
-    # def calculate_global_efficiency(self):
-    #     """
-    #     Calculates the average unweighted and weighted global efficiency of the graph.
-
-    #     Returns:
-    #         avg_global_eff_unweighted (float): The average unweighted global efficiency of the graph.
-    #         avg_global_eff_weighted (float): The average weighted global efficiency of the graph.
-    #     """
-    #     # Unweighted Global Efficiency
-    #     avg_global_eff_unweighted = nx.global_efficiency(self.G)
-
-    #     # Weighted Global Efficiency
-    #     # Inverting weights for efficiency calculation as smaller weights imply stronger connections
-    #     G_copy = self.G.copy()
-    #     inverted_weights = {(u, v): 1 / data['weight'] for u, v, data in G_copy.edges(data=True)}
-    #     nx.set_edge_attributes(G_copy, inverted_weights, 'inverted_weight')
-    #     avg_global_eff_weighted = nx.global_efficiency(nx.stochastic_graph(G_copy, weight='inverted_weight'))
-
-
-    #     return avg_global_eff_unweighted, avg_global_eff_weighted
+        Returns:
+            avg_local_eff_unweighted (float):  average unweighted local efficiency for i nodes.
+            avg_local_eff_weighted (float):  average weighted local efficiency for i nodes.
+        """
+        neighborhoods = self.adjacency | self.adjacency.T
+        np.fill_diagonal(neighborhoods, False)
+        local_efficiencies = np.zeros((len(self.nodes), 2))
+        for node, neighbors in enumerate(neighborhoods):
+            if neighbors.sum() > 1:
+                local_efficiencies[node] = [
+                    get_efficiency(shortest_path(lengths[np.ix_(neighbors, neighbors)], directed=self.is_directed))
+                    for lengths in self.lengths
+                ]
+        avg_local_eff_unweighted, avg_local_eff_weighted = (
+            local_efficiencies.mean(axis=0) if len(self.nodes) else (0, 0)
+        )
+        return avg_local_eff_unweighted, avg_local_eff_weighted
 
-    
+    def calculate_global_efficiency(self):
+        """
+        Calculates the average unweighted and weighted global efficiency of the graph
+        (mean inverse shortest path length between nodes, 0 for unreachable nodes).
+
+        Returns:
+            avg_global_eff_unweighted (float): The average unweighted global efficiency of the graph.
+            avg_global_eff_weighted (float): The average weighted global efficiency of the graph.
+        """
+        avg_global_eff_unweighted, avg_global_eff_weighted = (
+            get_efficiency(shortest_path(lengths, directed=self.is_directed))
+            for lengths in self.lengths
+        )
+        return avg_global_eff_unweighted, avg_global_eff_weighted
+
+    def calculate_characteristic_path_length(self):
+        """
+        Calculates the average unweighted and weighted characteristic path length of the graph
+        (mean shortest path length between nodes), None if some nodes can't be reached.
+
+        Returns:
+            avg_path_length_unweighted (float): The average unweighted characteristic path length of the graph.
+            avg_path_length_weighted (float): The average weighted characteristic path length of the graph.
+        """
+        avg_path_length_unweighted, avg_path_length_weighted = (
+            get_path_length(shortest_path(lengths, directed=self.is_directed))
+            for lengths in self.lengths
+        )
+        return avg_path_length_unweighted, avg_path_length_weighted
 
-    # def calculate_characteristic_path_length(self):
-    #     """
-    #     Calculates the average unweighted and weighted characteristic path length of the graph.
-
-    #     Returns:
-    #         avg_path_length_unweighted (float): The average unweighted characteristic path length of the graph.
-    #         avg_path_length_weighted (float): The average weighted characteristic path length of the graph.
-    #     """
-    #     if nx.is_connected(self.G):
-    #         avg_path_length_unweighted = nx.average_shortest_path_length(self.G)
-            
-    #         # Inverting weights for path length calculation as smaller weights imply stronger connections
-    #         G_copy = self.G.copy()
-    #         inverted_weights = {(u, v): 1 / data['weight'] for u, v, data in G_copy.edges(data=True)}
-    #         nx.set_edge_attributes(G_copy, inverted_weights, 'inverted_weight')
-    #         avg_path_length_weighted = nx.average_shortest_path_length(G_copy, weight='inverted_weight')
-    #     else:
-    #         avg_path_length_unweighted = None
-    #         avg_path_length_weighted = None
-
-    #     return avg_path_length_unweighted, avg_path_length_weighted
-    
\ No newline at end of file
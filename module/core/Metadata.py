@@ -20,6 +20,7 @@ class _ProjectSettings(ExcelDataset):
     project: str = field(default=None)
     _template: ClassVar[dict] = None
     _template_types: ClassVar[dict] = None
+    _template_defaults: ClassVar[dict] = {}  # values of settings added after files were created
     
     def __post_init__(self):
         """
@@ -81,6 +82,9 @@ class _ProjectSettings(ExcelDataset):
             raise ValueError(f"Wrong data types, please correct {self.filename}")
 
     def convert_dtypes(self, df):
+        for col_name, default in self._template_defaults.items():
+            if col_name not in df:
+                df[col_name] = default
         for col_name, col_info in self._template_types.items():
             if col_info["type"] == list:
                 df[col_name] = df[col_name].apply(
@@ -232,13 +236,16 @@ class ProjectInformation(_ProjectSettings):
         "outlier_test": ["grubbs"],
         "p_value_threshold": [0.05],
         "raw_data_filename": ["raw_data.csv"],
+        "lazy_ratios": [False],
     }
     _template_types: ClassVar[dict] = {
         "label": {"type": str},
         "outlier_test": {"type": str},
         "p_value_threshold": {"type": float},
         "raw_data_filename": {"type": str},
+        "lazy_ratios": {"type": bool},
     }
+    _template_defaults: ClassVar[dict] = {"lazy_ratios": False}
     
     def generate(self):
         from module.core.HPLC import OUTLIER_TESTS
@@ -274,6 +281,7 @@ class ProjectInformation(_ProjectSettings):
                 <li>Raw Data Filename: {self.raw_data_filename}</li>
                 <li>Outlier Test: {self.outlier_test}</li>
                 <li>P-Value Threshold: {self.p_value_threshold}</li>
+                <li>Lazy Ratios: {self.lazy_ratios}</li>
             </ul>
         """
 
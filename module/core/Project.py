@@ -61,7 +61,7 @@ class Project:
 
     @property
     def data(self) -> SelectableDataFrame:
-        return self.hplc.extend(self.treatment_information).extend(self.outliers)
+        return self.hplc.materialize().extend(self.treatment_information).extend(self.outliers)
 
     @classmethod
     def list(self):
@@ -1,9 +1,11 @@
+import os
 from dataclasses import dataclass, field
 from typing import ClassVar
 import pandas as pd
 import numpy as np
-from module.core.Dataset import PickleDataset, SelectableDataFrame
-from module.core.HPLC import HPLC
+from module.core.Dataset import ProjectDataset, SelectableDataFrame
+from module.core.FileSystem import FileSystem
+from module.core.HPLC import HPLC, categorize
 from module.core.Metadata import (
     ExperimentInformation,
     ProjectInformation,
@@ -12,7 +14,7 @@ from tqdm import tqdm
 import scipy
 import pingouin as pg
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
-from module.core.utils import parallel_process
+from module.core.utils import parallel_process, get_backend, get_content_hash, LRUCache, SharedFrame, SharedRows
 from IPython.display import HTML
 from module.core.utils import is_array_like
 import statsmodels.api as sm
@@ -28,7 +30,7 @@ def get_quantitative_statistics_pipeline(
 
     Args:
         multiple_factors (bool): Flag indicating if multiple factors are involved.
-        multiple_treatments (bool): Flag indicating if multiple treatments are considered.
+        multiple_treatments (bool): Flag indicating if more than two treatments are compared (two are compared with a t-test).
         paired (bool): Flag indicating if the design is paired.
         parametric (bool): Flag indicating if the tests should be parametric.
 
@@ -37,6 +39,7 @@ def get_quantitative_statistics_pipeline(
     """
     return {
         (False, False, False, True): ["ttest"],
+        (True, False, False, True): ["ttest"],
         (False, False, True, True): ["paired_ttest"],
         (False, True, False, True): ["one_way_anova", "tukey"],
         (False, True, True, True): ["repeated_measures_anova", "paired_ttest"],
@@ -44,6 +47,252 @@ def get_quantitative_statistics_pipeline(
     }[(multiple_factors, multiple_treatments, paired, parametric)]
 
 
+def stack_groupings(groupings) -> pd.DataFrame:
+    """
+    Values of all groupings in one frame with the grouping position and group (treatment) of each value.
+    Null values are dropped, as in QuantitativeStatistic.filtered_data.
+    """
+    values = [grouping.data.value.to_numpy(dtype=float) for grouping in groupings]
+    data = pd.DataFrame(
+        {
+            "grouping": np.repeat(np.arange(len(groupings)), [len(value) for value in values]),
+            "group": np.concatenate(
+                [grouping.data[grouping.group_column].astype(object).to_numpy() for grouping in groupings]
+            ) if groupings else [],
+            "value": np.concatenate(values) if groupings else [],
+        }
+    )
+    return data[data.value.notna()]
+
+
+def get_group_statistics(data) -> pd.DataFrame:
+    """Count, mean and sum of squared deviations of every (grouping, group)"""
+    group_statistics = data.groupby(["grouping", "group"], sort=False).value.agg(["count", "mean", "var"])
+    group_statistics["sum_sq"] = (group_statistics["var"] * (group_statistics["count"] - 1)).fillna(0)
+    return group_statistics
+
+
+def batch_one_way_anova(groupings) -> list[dict]:
+    """
+    One-way ANOVA of all groupings from grouped sums of squares, same results as get_one_way_anova.
+    """
+    group_statistics = get_group_statistics(stack_groupings(groupings))
+    grouping = group_statistics.index.get_level_values("grouping")
+    count = group_statistics["count"].groupby(grouping).sum()
+    grand_mean = (group_statistics["count"] * group_statistics["mean"]).groupby(grouping).sum() / count
+    between_sum_sq = (
+        group_statistics["count"] * (group_statistics["mean"] - grand_mean.reindex(grouping).to_numpy()) ** 2
+    ).groupby(grouping).sum()
+    within_sum_sq = group_statistics["sum_sq"].groupby(grouping).sum()
+    df1 = group_statistics["count"].groupby(grouping).size() - 1
+    df2 = count - df1 - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        F = (between_sum_sq / df1) / (within_sum_sq / df2)
+    p_values = scipy.stats.f.sf(F, df1, df2)
+    results = []
+    for position, grouping in enumerate(groupings):
+        if position not in F.index:
+            results.append(None)
+            continue
+        i = F.index.get_loc(position)
+        anova_table = pd.DataFrame(
+            {
+                "sum_sq": [between_sum_sq.iloc[i], within_sum_sq.iloc[i]],
+                "df": [float(df1.iloc[i]), float(df2.iloc[i])],
+                "F": [F.iloc[i], np.nan],
+                "PR(>F)": [p_values[i], np.nan],
+            },
+            index=[f"C({grouping.group_column})", "Residual"],
+        )
+        results.append(grouping.format_one_way_anova(anova_table))
+    return results
+
+
+def batch_ttest(groupings) -> list[dict]:
+    """
+    Independent t-tests (pooled variance) of all groupings between their two treatments,
+    same results as get_ttest.
+    """
+    group_statistics = get_group_statistics(stack_groupings(groupings))
+    results = []
+    for position, grouping in enumerate(groupings):
+        keys = [(position, treatment) for treatment in grouping.treatments[:2]]
+        if len(grouping.treatments) != 2 or not all(key in group_statistics.index for key in keys):
+            results.append(None)
+            continue
+        (n1, mean1, _, sum_sq1), (n2, mean2, _, sum_sq2) = group_statistics.loc[keys].to_numpy()
+        df = n1 + n2 - 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (mean1 - mean2) / np.sqrt((sum_sq1 + sum_sq2) / df * (1 / n1 + 1 / n2))
+        results.append(grouping.format_ttest(t, int(df), 2 * scipy.stats.t.sf(abs(t), df)))
+    return results
+
+
+def batch_tukey(groupings) -> list[dict]:
+    """
+    Tukey HSD of all groupings, same results as get_tukey (pairwise_tukeyhsd).
+    Pairs of every grouping are built at once and the studentized range distribution
+    is evaluated for all of them in one call, critical values once per (groups, df, alpha).
+    """
+    group_statistics = get_group_statistics(stack_groupings(groupings)).sort_index().reset_index()
+    # groups are sorted (as np.unique) within each grouping
+    group_statistics["position"] = group_statistics.groupby("grouping").cumcount()
+    grouped = group_statistics.groupby("grouping")
+    group_statistics["n_groups"] = grouped.group.transform("size")
+    group_statistics["df"] = grouped["count"].transform("sum") - group_statistics.n_groups
+    group_statistics["mse"] = grouped.sum_sq.transform("sum") / group_statistics.df
+    pairs = group_statistics.merge(group_statistics, on=["grouping", "n_groups", "df", "mse"], suffixes=("1", "2"))
+    pairs = pairs[pairs.position1 < pairs.position2].sort_values(["grouping", "position1", "position2"])
+    alphas = np.array([float(grouping.p_value_threshold) for grouping in groupings])
+    pairs["alpha"] = alphas[pairs.grouping.to_numpy()]
+    meandiff = pairs.mean2 - pairs.mean1
+    std_pairs = np.sqrt(pairs.mse * (1 / pairs.count1 + 1 / pairs.count2) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        studentized_range = np.abs(meandiff) / std_pairs
+    p_values = scipy.stats.studentized_range.sf(studentized_range, pairs.n_groups, pairs.df)
+    critical_values = {
+        key: scipy.stats.studentized_range.ppf(1 - key[2], key[0], key[1])
+        for key in set(zip(pairs.n_groups, pairs.df, pairs.alpha))
+    }
+    q_critical = np.array([critical_values[key] for key in zip(pairs.n_groups, pairs.df, pairs.alpha)])
+    tables = pd.DataFrame(
+        {
+            "grouping": pairs.grouping.to_numpy(),
+            "group1": pairs.group1.to_numpy(),
+            "group2": pairs.group2.to_numpy(),
+            "meandiff": np.round(meandiff.to_numpy(), 4),
+            "p-adj": np.round(p_values, 4),
+            "lower": np.round((meandiff - std_pairs * q_critical).to_numpy(), 4),
+            "upper": np.round((meandiff + std_pairs * q_critical).to_numpy(), 4),
+            "reject": (studentized_range > q_critical).to_numpy(),
+        }
+    )
+    tables = {
+        position: table.drop(columns="grouping").reset_index(drop=True)
+        for position, table in tables.groupby("grouping")
+    }
+    return [
+        grouping.format_tukey(tables[position]) if position in tables else None
+        for position, grouping in enumerate(groupings)
+    ]
+
+
+# Tests that can be computed for all groupings at once: groupings -> result (or None) per grouping
+BATCH_TESTS = {
+    "one_way_anova": batch_one_way_anova,
+    "ttest": batch_ttest,
+    "tukey": batch_tukey,
+}
+
+
+def calculate_statistics(groupings) -> list["QuantitativeStatistic"]:
+    """
+    Executes delayed statistics, tests of BATCH_TESTS are computed for all groupings at once.
+    Groupings that only need batched tests are executed in process, the others in parallel.
+
+    Args:
+        groupings (list[QuantitativeStatistic]): Statistics created with delay_execution
+
+    Returns:
+        list[QuantitativeStatistic]: The executed statistics, in the same order
+    """
+    for test, batch_test in BATCH_TESTS.items():
+        batched = [grouping for grouping in groupings if test in grouping.pipeline]
+        if batched:
+            for grouping, result in zip(batched, batch_test(batched)):
+                if result is not None:
+                    grouping.precomputed[test] = result
+    is_batched = [set(grouping.pipeline) <= set(grouping.precomputed) for grouping in groupings]
+    remaining = [grouping for grouping, batched in zip(groupings, is_batched) if not batched]
+    calculated = []
+    if remaining and get_backend(len(remaining)) == "process":
+        data = [grouping.data for grouping in remaining]
+        try:
+            with share_data(remaining):
+                calculated = parallel_process(remaining, description="Calculating statistics", backend="process")
+        finally:
+            for grouping, grouping_data in zip(remaining, data):
+                grouping.data = grouping_data
+        for statistic, grouping_data in zip(calculated, data):
+            statistic.data = grouping_data
+    elif remaining:
+        # executed in this process, the data doesn't need to be shared
+        calculated = parallel_process(remaining, description="Calculating statistics")
+    calculated = iter(calculated)
+    return [
+        grouping() if batched else next(calculated)
+        for grouping, batched in zip(groupings, is_batched)
+    ]
+
+
+def share_data(groupings) -> SharedFrame:
+    """
+    Writes the data of delayed statistics to a SharedFrame and replaces it with their SharedRows,
+    workers then read their rows instead of receiving pickled DataFrames.
+    Only worth it with the process backend, the caller restores the data.
+
+    Returns:
+        SharedFrame: The shared data, to close once the statistics are executed
+    """
+    shared_frame = SharedFrame(pd.concat([grouping.data for grouping in groupings]))
+    start = 0
+    for grouping in groupings:
+        stop = start + len(grouping.data)
+        grouping.data = SharedRows(shared_frame, start, stop)
+        start = stop
+    return shared_frame
+
+
+def calculate_memoized_statistics(groupings) -> list["QuantitativeStatistic"]:
+    """
+    calculate_statistics for the groupings that are not in STATISTICS_CACHE (by grouping hash).
+    Memoized statistics are shared between callers and must not be modified.
+
+    Args:
+        groupings (list[QuantitativeStatistic]): Statistics created with delay_execution
+
+    Returns:
+        list[QuantitativeStatistic]: The executed statistics, in the same order
+    """
+    grouping_hashes = [get_grouping_hash(grouping) for grouping in groupings]
+    missing = {
+        grouping_hash: grouping
+        for grouping, grouping_hash in zip(groupings, grouping_hashes)
+        if grouping_hash not in STATISTICS_CACHE
+    }
+    calculated = dict(zip(missing, calculate_statistics(list(missing.values()))))
+    for grouping_hash, statistic in calculated.items():
+        STATISTICS_CACHE[grouping_hash] = statistic
+    return [
+        calculated[grouping_hash] if grouping_hash in calculated else STATISTICS_CACHE[grouping_hash]
+        for grouping_hash in grouping_hashes
+    ]
+
+
+def get_grouping_hash(statistic) -> str:
+    """
+    Content hash of a delayed statistic: its data, experiment settings, pipeline and metadata.
+    Outlier states are part of the data as outliers are removed before grouping.
+    """
+    data = statistic.data[[column for column in GROUPING_HASH_COLUMNS if column in statistic.data]]
+    settings = (
+        statistic.independant_variables,
+        statistic.treatments,
+        statistic.is_paired,
+        statistic.is_parametric,
+        statistic.p_value_threshold,
+        statistic.pipeline,
+        statistic.group_column,
+        sorted(statistic.metadata.items()),
+    )
+    return get_content_hash(data, settings)
+
+
+GROUPING_HASH_COLUMNS = ["mouse_id", "group_id", "treatment", "independant_variables", "value"]
+# Process wide memo of executed statistics of data selections, keyed on grouping hash
+STATISTICS_CACHE = LRUCache(maxsize=1024)
+
+
 @dataclass
 class QuantitativeStatistic:
     """
@@ -60,7 +309,7 @@ class QuantitativeStatistic:
         _type_: _description_
     """
 
-    data: pd.DataFrame
+    data: pd.DataFrame = field(repr=False)
     independant_variables: list[str]
     treatments: list[str]
     is_paired: bool
@@ -70,30 +319,30 @@ class QuantitativeStatistic:
     delay_execution: bool = field(default=False, kw_only=True)
     metadata: dict = field(default_factory=dict, kw_only=True)
     pipeline: list = field(default=None, kw_only=True)
+    precomputed: dict = field(default_factory=dict, kw_only=True)
 
     def __post_init__(self):
+        self.pipeline = self.pipeline or get_quantitative_statistics_pipeline(
+            len(self.independant_variables) >= 2,
+            len(self.treatments) > 2,
+            self.is_paired,
+            self.is_parametric,
+        )
         if self.delay_execution:
             self.delay_execution = False
         else:
-            self.filtered_data = self.data.select(value="notna")
+            self.filtered_data = self.data.select(value="notna").remove_unused_categories()
             # check all treatments present and enough data
             self.has_enough_data = set(
                 self.filtered_data[self.group_column].unique()
             ) == set(self.treatments) and all(
                 [
                     group_data.value.count() >= 5
-                    for _, group_data in self.filtered_data.groupby(self.group_column)
+                    for _, group_data in self.filtered_data.groupby(self.group_column, observed=True)
                 ]
             )
-            self.pipeline = self.pipeline or get_quantitative_statistics_pipeline(
-                len(self.independant_variables) >= 2,
-                len(self.treatments) >= 2,
-                self.is_paired,
-                self.is_parametric,
-            )
             self.statistical_test = self.pipeline[0]
             self.post_hoc_test = self.pipeline[-1]
-            self.filtered_data = self.data.select(value="notna")
             if self.has_enough_data:
                 self.results = SelectableDataFrame(self.execute_stats_pipeline())
                 self.significant_pairs = (
@@ -127,10 +376,12 @@ class QuantitativeStatistic:
         region: str = None,
         p_value_threshold: float = None,
         remove_outliers="calculated",
+        from_scratch=False,
     ):
         """
         Calculate statistical results for a given experiment, compound, and region.
         If one ore some of the parameters are None or lists, calculate the results for all possible combinations.
+        Results of groupings whose content did not change are reused from StatisticsCache.
 
         Args:
             project (str): The name of the project.
@@ -139,6 +390,7 @@ class QuantitativeStatistic:
             region (str|list): The name of the region.
             p_value_threshold (float, optional): The p-value threshold used for statistical analysis. Defaults to None.
             remove_outliers (str, optional): Whether to remove outliers. Must be 'eliminated', 'calculated', or False. Defaults to "calculated".
+            from_scratch (bool, optional): Recalculate all groupings, clearing StatisticsCache. Defaults to False.
 
         Returns:
             SelectableDataFrame: Containing the statistical results.
@@ -147,15 +399,15 @@ class QuantitativeStatistic:
             ValueError: If remove_outliers is not 'eliminated', 'calculated', or False.
         """
 
-        data = HPLC(project).full_df
-
         if compound:
             compounds = (
                 compound
                 if is_array_like(compound)
                 else compound.replace(" ", "").split(",")
             )
+            data = HPLC(project).get_full_df(compounds)
         else:
+            data = HPLC(project).full_df
             compounds = data.compound.unique()
 
         if region:
@@ -218,22 +470,44 @@ class QuantitativeStatistic:
                     )
                     for (region, compound), group_data in tqdm(
                         data.select(treatment=experiment.treatments).groupby(
-                            ["region", "compound"]
+                            ["region", "compound"], observed=True
                         ),
                         desc=f"Preparing statistical groupings for {experiment.label}",
                     )
                 ]
             )
 
-        statistics = parallel_process(groupings, description="Calculating statistics")
+        statistics_cache = StatisticsCache(project)
+        if from_scratch:
+            statistics_cache.clear()
+        grouping_hashes = [get_grouping_hash(grouping) for grouping in groupings]
+        cached_results = {} if from_scratch else statistics_cache.get_results(grouping_hashes)
+        statistics = iter(
+            calculate_statistics(
+                [
+                    grouping
+                    for grouping, grouping_hash in zip(groupings, grouping_hashes)
+                    if grouping_hash not in cached_results
+                ]
+            )
+        )
 
-        results = []
-        for statistic in statistics:
-            result = statistic.results
-            result["fully_significant"] = statistic.is_significant
+        results, calculated_results = [], []
+        for grouping_hash in grouping_hashes:
+            if grouping_hash in cached_results:
+                result = cached_results[grouping_hash]
+            else:
+                statistic = next(statistics)
+                result = statistic.results
+                result["fully_significant"] = statistic.is_significant
+                result["grouping_hash"] = grouping_hash
+                calculated_results.append(result)
             results.append(result)
+        results = pd.concat(results)
+        if calculated_results:
+            statistics_cache.update(pd.concat(calculated_results))
 
-        return SelectableDataFrame(pd.concat(results))
+        return SelectableDataFrame(categorize(results.drop(columns="grouping_hash")))
     
     @staticmethod
     def calculate_from_selection(
@@ -244,6 +518,7 @@ class QuantitativeStatistic:
     ):
         """
         Calculate statistical for data, autmaticcaly groups by experiment, compound regions.
+        Groupings already calculated in the process are reused (see calculate_memoized_statistics).
 
         Args:
             data (pd.DataFrame): The name of the project.
@@ -279,18 +554,19 @@ class QuantitativeStatistic:
                     )
                     for (region, compound), group_data in tqdm(
                         data.select(treatment=experiment.treatments).groupby(
-                            ["region", "compound"]
+                            ["region", "compound"], observed=True
                         ),
                         desc=f"Preparing statistical groupings for {experiment.label}",
                     )
                 ]
             )
 
-        statistics = parallel_process(groupings, description="Calculating statistics")
+        statistics = calculate_memoized_statistics(groupings)
 
         results = []
         for statistic in statistics:
-            result = statistic.results
+            # memoized results are shared, annotate a copy
+            result = statistic.results.copy()
             result["fully_significant"] = statistic.is_significant
             results.append(result)
 
@@ -298,6 +574,8 @@ class QuantitativeStatistic:
 
     # for parallel
     def __call__(self):
+        if isinstance(self.data, SharedRows):
+            self.data = SelectableDataFrame(self.data.load())
         self.__post_init__()
         return self 
 
@@ -308,7 +586,7 @@ class QuantitativeStatistic:
             if not hasattr(self, test_method_name):
                 raise ValueError(f"Unknown test: {test}")
             test_method = self.__getattribute__(test_method_name)
-            test_result = test_method()
+            test_result = self.precomputed[test] if test in self.precomputed else test_method()
             results.append(
                 {
                     **test_result,
@@ -338,7 +616,9 @@ class QuantitativeStatistic:
             groups=self.filtered_data[self.group_column],
             alpha=self.p_value_threshold,
         )._results_table.data
-        results = pd.DataFrame(stats_data, columns=columns)
+        return self.format_tukey(pd.DataFrame(stats_data, columns=columns))
+
+    def format_tukey(self, results):
         significance_infos = pd.DataFrame(
             list(
                 results[results.reject].apply(
@@ -372,10 +652,12 @@ class QuantitativeStatistic:
                 - A DataFrame containing the ANOVA test results (F-value and p-value).
         """
         model = ols(f'value ~ C({self.group_column})', data=self.filtered_data).fit()
-        anova_table = sm.stats.anova_lm(model, typ=2)
-        p_value = round(anova_table["PR(>F)"][0],2)
-        F = round(anova_table['F'][0], 2)
-        df1, df2 = int(anova_table['df'][0]), int(anova_table['df'][1])
+        return self.format_one_way_anova(sm.stats.anova_lm(model, typ=2))
+
+    def format_one_way_anova(self, anova_table):
+        p_value = round(anova_table["PR(>F)"].iloc[0], 2)
+        F = round(anova_table['F'].iloc[0], 2)
+        df1, df2 = int(anova_table['df'].iloc[0]), int(anova_table['df'].iloc[1])
         is_significant = p_value <= self.p_value_threshold
         return {
             "p_value": p_value,
@@ -384,6 +666,33 @@ class QuantitativeStatistic:
             "result_string": f"F({df1}, {df2}) = {F}, p = {p_value} {'*' * is_significant}",
         }
 
+    def get_ttest(self):
+        """
+        Performs an independent t-test (pooled variance) between the two treatments.
+
+        Returns:
+            dict: p_value, is_significant, result (t, df and p) and result_string
+        """
+        if len(self.treatments) != 2:
+            raise ValueError(f"A t-test compares two treatments, got {self.treatments}")
+        first, second = [
+            self.filtered_data[self.filtered_data[self.group_column] == treatment].value
+            for treatment in self.treatments
+        ]
+        t, p_value = scipy.stats.ttest_ind(first, second)
+        return self.format_ttest(t, len(first) + len(second) - 2, p_value)
+
+    def format_ttest(self, t, df, p_value):
+        result = pd.DataFrame([{"T": t, "dof": df, "p-val": p_value}])
+        p_value = round(p_value, 2)
+        is_significant = p_value <= self.p_value_threshold
+        return {
+            "p_value": p_value,
+            "is_significant": is_significant,
+            "result": result,
+            "result_string": f"t({df}) = {round(t, 2)}, p = {p_value} {'*' * is_significant}",
+        }
+
     def get_two_way_anova(self):
         """
         Performs a two-way ANOVA to evaluate the effect of two nominal predictor variables on a continuous outcome variable.
@@ -424,7 +733,128 @@ class QuantitativeStatistic:
 
 
 @dataclass(repr=False)
-class Statistics(PickleDataset):
+class StatisticsCache:
+    """
+    Results of every statistical grouping calculated for the project (significant or not),
+    keyed by the content hash of the grouping (see get_grouping_hash): results of the same
+    data with other settings (ex: p_value_threshold) are kept side by side.
+    Results are stored in shards by hash prefix, reads and updates only touch the shards
+    of the requested groupings instead of the whole project. An index of the hashes of each
+    grouping bounds the number of versions kept (see update).
+    Used by QuantitativeStatistic.calculate to only recalculate groupings that changed.
+    """
+
+    project: str
+    prefix_length: ClassVar[int] = 2  # 256 shards
+    max_versions: ClassVar[int] = 4
+    identity_columns: ClassVar[list[str]] = ["experiment", "compound", "region"]
+
+    def get_results(self, grouping_hashes) -> dict:
+        """
+        Args:
+            grouping_hashes (list[str]): Hashes of the groupings to read
+
+        Returns:
+            dict: Results of each cached grouping hash
+        """
+        results = {}
+        for prefix, hashes in self.group_by_shard(grouping_hashes).items():
+            filepath = self.get_shard_filepath(prefix)
+            if not os.path.isfile(f"{filepath}.{StatisticsCacheShard.extension}"):
+                continue
+            data = StatisticsCacheShard(self.project, prefix, filepath=filepath).load(
+                filters={"grouping_hash": hashes}
+            )
+            results.update(dict(list(data.groupby("grouping_hash", sort=False))))
+        return results
+
+    def update(self, results):
+        """
+        Replaces the cached results of the grouping hashes present in results, only their shards are rewritten.
+        Only the max_versions last calculated hashes of each grouping (experiment, compound, region) are kept,
+        older ones (previous outlier states, thresholds..) are pruned from their shards.
+        """
+        stale_hashes = self.update_index(results)
+        updated_hashes = set(results.grouping_hash) | stale_hashes
+        for prefix, hashes in self.group_by_shard(updated_hashes).items():
+            shard_results = results[results.grouping_hash.isin(hashes)]
+            filepath = self.get_shard_filepath(prefix)
+            if shard_results.empty and not os.path.isfile(f"{filepath}.{StatisticsCacheShard.extension}"):
+                continue
+            shard = StatisticsCacheShard(self.project, prefix, filepath=filepath)
+            data = shard.df
+            data = data[~data.grouping_hash.isin(hashes)]
+            if data.empty and shard_results.empty:
+                shard.delete()
+                continue
+            shard.save(
+                pd.concat([data, shard_results]).reset_index(drop=True)
+                if len(data)
+                else shard_results.reset_index(drop=True)
+            )
+
+    def update_index(self, results) -> set:
+        """
+        Records the grouping hashes of results as the last versions of their groupings in the index.
+
+        Returns:
+            set: Hashes of the versions beyond max_versions, removed from the index
+        """
+        identity_columns = [column for column in self.identity_columns if column in results]
+        index = StatisticsCacheShard(self.project, "index", filepath=self.get_shard_filepath("index"))
+        data = index.df
+        version = int(data.version.max()) + 1 if len(data) else 0
+        versions = results[[*identity_columns, "grouping_hash"]].drop_duplicates("grouping_hash").assign(version=version)
+        data = data[~data.grouping_hash.isin(versions.grouping_hash)]
+        data = pd.concat([data, versions]).reset_index(drop=True) if len(data) else versions.reset_index(drop=True)
+        is_stale = (
+            data.sort_values("version", ascending=False, kind="stable")
+            .groupby(identity_columns, dropna=False, sort=False)
+            .cumcount()
+            >= self.max_versions
+        ).reindex(data.index)
+        index.save(data[~is_stale].reset_index(drop=True))
+        return set(data.grouping_hash[is_stale])
+
+    def clear(self):
+        """Deletes the cached results of the project (calculations from scratch)"""
+        for filename in os.listdir(self.location):
+            prefix, _ = os.path.splitext(filename)
+            StatisticsCacheShard(self.project, prefix, filepath=self.get_shard_filepath(prefix)).delete()
+
+    @property
+    def location(self) -> str:
+        location = os.path.join(FileSystem.get_location(project=self.project), StatisticsCacheShard.filename)
+        os.makedirs(location, exist_ok=True)
+        return location
+
+    def get_shard_filepath(self, prefix) -> str:
+        return os.path.join(self.location, prefix)
+
+    def group_by_shard(self, grouping_hashes) -> dict:
+        shards = {}
+        for grouping_hash in dict.fromkeys(grouping_hashes):
+            shards.setdefault(grouping_hash[: self.prefix_length], []).append(grouping_hash)
+        return shards
+
+
+@dataclass(repr=False)
+class StatisticsCacheShard(ProjectDataset):
+    """
+    Cached results of the groupings whose hash starts with prefix, see StatisticsCache.
+    The 'index' prefix holds the versions of each grouping instead.
+    """
+
+    project: str
+    prefix: str
+    filename: ClassVar[str] = "statistics_cache"
+
+    def generate(self):
+        return pd.DataFrame(columns=["grouping_hash"])
+
+
+@dataclass(repr=False)
+class Statistics(ProjectDataset):
     """
     Contains all quantitative statistical resuts for hplc
 
@@ -456,7 +886,7 @@ class Statistics(PickleDataset):
         return data
 
     def generate(self):
-        return QuantitativeStatistic.calculate(self.project).select(
+        return QuantitativeStatistic.calculate(self.project, from_scratch=self.from_scratch).select(
             fully_significant=True
         )
 
@@ -472,7 +902,7 @@ class Statistics(PickleDataset):
                 [
                     results
                     for _, results in self.df.groupby(
-                        ["experiment", "compound", "region"]
+                        ["experiment", "compound", "region"], observed=True
                     )
                     if results.is_significant.all()
                 ]
@@ -499,7 +929,7 @@ class Statistics(PickleDataset):
 
 
 @dataclass
-class AggregateStatistics(PickleDataset):
+class AggregateStatistics(ProjectDataset):
     """
     Calculates group level descriptive statistics.
     """
@@ -510,7 +940,7 @@ class AggregateStatistics(PickleDataset):
     def generate(self):
         result_ls = []
         for (treatment, region, compound), groupby_df in tqdm(
-            HPLC(self.project).full_df.select(value="notna", is_outlier=False).groupby(by=["treatment", "region", "compound"]),
+            HPLC(self.project).full_df.select(value="notna", is_outlier=False).groupby(by=["treatment", "region", "compound"], observed=True),
             desc="Calculating aggregate statistics",
         ):
             
@@ -529,7 +959,7 @@ class AggregateStatistics(PickleDataset):
             result_ls.append(
                 [treatment, region, compound, F, p, is_parametric, mean, std, sem, values]
             )
-        return pd.DataFrame(
+        return categorize(pd.DataFrame(
             result_ls,
             columns=[
                 "treatment",
@@ -543,6 +973,6 @@ class AggregateStatistics(PickleDataset):
                 "sem",
                 "values",
             ],
-        )
+        ), self.project)
         
         
@@ -1,5 +1,5 @@
 from .FileSystem import FileSystem
-from .Dataset import ExcelDataset, PickleDataset
+from .Dataset import ExcelDataset, PickleDataset, ParquetDataset
 from .Project import Project
 from .HPLC import HPLC
 from .Statistics import Statistics, QuantitativeStatistic
@@ -12,6 +12,7 @@ __all__ = [
     "FileSystem",
     "ExcelDataset",
     "PickleDataset",
+    "ParquetDataset",
     "Project",
     "HPLC",
     "Statistics",
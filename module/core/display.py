@@ -185,14 +185,14 @@ def playground():
     def update_project(_):
         project = project_dropdown.value
         print(f"PROJECT: {project}")
-        data = HPLC(project).df
+        hplc = HPLC(project)
         treatment_information = TreatmentInformation(project)
         experiment_information = ExperimentInformation(project)
 
         compounds_constant = COMPOUNDS.list
-        data_compounds = data.compound.unique()
+        data_compounds = hplc.compounds
         regions_constant = REGIONS.list
-        data_regions = data.region.unique()
+        data_regions = hplc.regions
 
         region_ordered_select_multiple.options = [
             region for region in regions_constant if region in data_regions
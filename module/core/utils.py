@@ -1,5 +1,10 @@
-from tqdm.contrib.concurrent import process_map
-import itertools
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import atexit, hashlib, itertools, multiprocessing, os, pickle, sys, tempfile
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
 from collections.abc import Iterable
 
 
@@ -29,19 +34,324 @@ def call_case(case):
     return case()
 
 
-def parallel_process(cases, executor=call_case, description="Processing"):
+# Worker pool settings, see configure_pool
+POOL_SETTINGS = {
+    "backend": os.environ.get("PARALLEL_BACKEND", "process"),  # default backend of parallel_process
+    "size": int(os.environ.get("POOL_SIZE", 0)) or None,  # None: number of cpus
+    "start_method": os.environ.get("POOL_START_METHOD"),  # 'fork', 'forkserver', 'spawn' or None (platform default)
+    "in_process_threshold": int(os.environ.get("POOL_IN_PROCESS_THRESHOLD", 4)),
+}
+_pool = None
+
+
+def configure_pool(**settings):
+    """
+    Updates POOL_SETTINGS (backend, size, start_method, in_process_threshold).
+    The current pool is shut down and the next one is created with the new settings.
+    """
+    unknown_settings = set(settings) - set(POOL_SETTINGS)
+    if unknown_settings:
+        raise ValueError(f"Unknown pool settings: {unknown_settings}, possible settings are {list(POOL_SETTINGS)}")
+    shutdown_pool()
+    POOL_SETTINGS.update(settings)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Worker pool shared by parallel_process calls, created on first use"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=POOL_SETTINGS["size"],
+            mp_context=multiprocessing.get_context(POOL_SETTINGS["start_method"]),
+        )
+    return _pool
+
+
+def shutdown_pool(wait=True):
+    """Shuts the worker pool down, called at exit"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def get_chunksize(n_cases, n_workers):
+    """Cases sent to a worker at once, about 4 chunks per worker (as multiprocessing.Pool.map)"""
+    chunksize, remainder = divmod(n_cases, n_workers * 4)
+    return chunksize + 1 if remainder else max(chunksize, 1)
+
+
+class CaseError(Exception):
+    """
+    Raised by parallel_process when the executor fails on a case.
+
+    Args:
+        index (int): Position of the case
+        case (str): Short representation of the case
+        error (str): The original error
+    """
+
+    def __init__(self, index, case, error):
+        super().__init__(index, case, error)
+        self.index, self.case, self.error = index, case, error
+
+    def __str__(self):
+        return f"Case {self.index} failed: {self.error}\n{self.case}"
+
+
+def execute_case(executor_index_case):
+    """Calls executor on a case, errors are raised as CaseError"""
+    executor, index, case = executor_index_case
+    try:
+        return executor(case)
+    except Exception as error:
+        raise CaseError(index, repr(case)[:500], f"{type(error).__name__}: {error}") from error
+
+
+def run_serial(indexed_cases, chunksize):
+    return map(execute_case, indexed_cases)
+
+
+def run_threads(indexed_cases, chunksize):
+    with ThreadPoolExecutor(max_workers=POOL_SETTINGS["size"]) as executor:
+        try:
+            yield from executor.map(execute_case, indexed_cases)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def run_processes(indexed_cases, chunksize):
+    try:
+        yield from get_pool().map(execute_case, indexed_cases, chunksize=chunksize)
+    except BrokenProcessPool:
+        # a worker died, the next call gets a new pool
+        shutdown_pool(wait=False)
+        raise
+
+
+# Execution backends of parallel_process: (cases, chunksize) -> iterator of results in order
+BACKENDS = {
+    "serial": run_serial,
+    "thread": run_threads,
+    "process": run_processes,
+}
+
+
+def get_backend(n_cases, backend=None) -> str:
+    """
+    Backend that parallel_process uses for n_cases: backend (default POOL_SETTINGS['backend']),
+    serial below POOL_SETTINGS['in_process_threshold'] cases.
+    """
+    backend = backend or POOL_SETTINGS["backend"]
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}, possible backends are {list(BACKENDS)}")
+    return "serial" if n_cases < POOL_SETTINGS["in_process_threshold"] else backend
+
+
+def parallel_process(cases, executor=call_case, description="Processing", chunksize=None, backend=None):
     """Executes the operations performed by {executor} once per case in cases in parralel
+    The backend (serial, thread or process) defaults to POOL_SETTINGS['backend'] (PARALLEL_BACKEND environment variable).
+    Process workers are reused between calls (see get_pool), with fewer cases than
+    POOL_SETTINGS['in_process_threshold'] cases are executed serially.
+    Large inputs can be passed as a SharedFrame and SharedRows in cases.
 
     Args:
         executor (function): function to be executed, must take a single argument and unpack if necessary
         cases (list(args)): different arguments to be used by executor. Case == [arg1, arg2, ...] for executor(case)
+        chunksize (int, optional): Cases sent to a worker at once. Defaults to None (from the number of cases and workers).
+        backend (str, optional): 'serial', 'thread' or 'process'. Defaults to None (POOL_SETTINGS['backend']).
+
+    Raises:
+        CaseError: If executor fails on a case, identifies the case
 
     Returns:
         List of results from executor
     """
-    results = process_map(executor, cases, desc=description, chunksize=1)
-    return results
+    cases = list(cases)
+    backend = get_backend(len(cases), backend)
+    chunksize = chunksize or get_chunksize(
+        len(cases), POOL_SETTINGS["size"] or os.cpu_count() or 1
+    )
+    indexed_cases = [(executor, index, case) for index, case in enumerate(cases)]
+    return list(
+        tqdm(
+            BACKENDS[backend](indexed_cases, chunksize),
+            total=len(cases),
+            desc=description,
+        )
+    )
+
+
+class SharedFrame:
+    """
+    DataFrame written once to a memory mapped file so that workers read the rows they need
+    (see SharedRows) instead of receiving pickled DataFrames.
+    Pickled as the path and layout of its columns: numeric columns are stored as is,
+    categorical columns as codes and other columns as codes of their (pickled if unhashable) unique values.
+    Use as a context manager to delete the file.
+
+    Args:
+        data (pd.DataFrame): The data to share
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.length = len(data)
+        arrays, self.layout, offset = [], [], 0
+        for name, column in [("__index__", data.index.to_series()), *data.items()]:
+            array, encoding = encode_column(column)
+            array = np.ascontiguousarray(array)
+            self.layout.append((name, array.dtype.str, offset, encoding))
+            arrays.append((offset, array))
+            offset += -(-array.nbytes // 8) * 8  # 8 bytes aligned
+        file_descriptor, self.filepath = tempfile.mkstemp(suffix=".frame")
+        os.close(file_descriptor)
+        buffer = np.memmap(self.filepath, dtype=np.uint8, mode="w+", shape=max(offset, 1))
+        for offset, array in arrays:
+            buffer[offset : offset + array.nbytes] = np.frombuffer(array.tobytes(), dtype=np.uint8)
+        buffer.flush()
+        del buffer
+
+    def rows(self, start, stop) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: Copy of the rows from start to stop (excluded)
+        """
+        columns = {}
+        for name, dtype, offset, encoding in self.layout:
+            dtype = np.dtype(dtype)
+            array = (
+                np.array(
+                    np.memmap(
+                        self.filepath,
+                        dtype=dtype,
+                        mode="r",
+                        offset=offset + start * dtype.itemsize,
+                        shape=(stop - start,),
+                    )
+                )
+                if stop > start
+                else np.empty(0, dtype=dtype)
+            )
+            columns[name] = decode_column(array, encoding)
+        index = columns.pop("__index__")
+        return pd.DataFrame(columns, index=pd.Index(index))
+
+    def close(self):
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def encode_column(column: pd.Series):
+    """Array stored in a SharedFrame for a column and what is needed to decode it"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), ("categorical", column.cat.categories.to_numpy(), column.cat.ordered)
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM":
+        return column.to_numpy(), None
+    try:
+        codes, uniques = pd.factorize(column)
+        return codes, ("factorized", np.asarray(uniques, dtype=object), False)
+    except TypeError:  # unhashable values (lists..)
+        codes, uniques = pd.factorize(column.map(pickle.dumps))
+        return codes, ("factorized", np.asarray(uniques, dtype=object), True)
+
+
+def decode_column(array, encoding):
+    if encoding is None:
+        return array
+    kind, uniques, option = encoding
+    if kind == "categorical":
+        return pd.Categorical.from_codes(array, categories=uniques, ordered=option)
+    # filled one by one so that sequences stay values, code -1 is a missing value
+    values = np.empty(len(uniques) + 1, dtype=object)
+    for position, value in enumerate(uniques):
+        values[position] = pickle.loads(value) if option else value
+    values[-1] = np.nan
+    return values[array]
+
+
+class SharedRows:
+    """
+    Rows of a SharedFrame, loaded in the worker with load()
+    """
+
+    def __init__(self, frame: SharedFrame, start: int, stop: int):
+        self.frame, self.start, self.stop = frame, start, stop
+
+    def load(self) -> pd.DataFrame:
+        return self.frame.rows(self.start, self.stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+def get_content_hash(data: pd.DataFrame, settings) -> str:
+    """
+    Content hash of a delayed calculation (statistics, matrices): the values of data
+    (as strings, index ignored) and the repr of its settings.
+    """
+    digest = hashlib.sha1(
+        pd.util.hash_pandas_object(data.astype(str), index=False).to_numpy().tobytes()
+    )
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
 
 
 def flatten(two_dimension_list):
     return list(itertools.chain.from_iterable(two_dimension_list))
+
+
+class LRUCache(OrderedDict):
+    """
+    Dictionary that keeps at most maxsize items, evicting the least recently used ones.
+    Reading or writing an item marks it as recently used.
+    If maxbytes is provided, items are also evicted until the total size (measured with sizeof) fits.
+
+    Args:
+        maxsize (int): Maximum number of items kept. Defaults to 128.
+        maxbytes (int, optional): Maximum total size of the items kept. Defaults to None (no limit).
+        sizeof (Callable, optional): Returns the size of an item in bytes. Defaults to sys.getsizeof.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=sys.getsizeof):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.sizes = {}
+        super().__init__()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.maxbytes is not None:
+            self.sizes[key] = self.sizeof(value)
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize or (
+            self.maxbytes is not None and sum(self.sizes.values()) > self.maxbytes
+        ):
+            self.popitem(last=False)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.sizes.pop(key, None)
+
+    def popitem(self, last=True):
+        key, value = super().popitem(last=last)
+        self.sizes.pop(key, None)
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self.sizes.clear()
@@ -0,0 +1,68 @@
+import os, tempfile, unittest
+from unittest.mock import patch
+import pandas as pd
+from module.core.Cacheable import LOAD_CACHE
+from module.core.Dataset import PickleDataset
+from module.core.utils import LRUCache
+
+
+class Frame(PickleDataset):
+    filename = "frame"
+
+    def generate(self):
+        return pd.DataFrame({"value": range(1000)})
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_maxsize_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache["a"], cache["b"] = 1, 2
+        cache["a"]
+        cache["c"] = 3
+        self.assertEqual(list(cache), ["a", "c"])
+
+    def test_maxbytes_evicts_until_fit(self):
+        cache = LRUCache(maxsize=10, maxbytes=10, sizeof=len)
+        cache["a"], cache["b"] = "aaaa", "bbbb"
+        cache["c"] = "cccc"
+        self.assertEqual(list(cache), ["b", "c"])
+        cache["d"] = "d" * 11
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.sizes, {})
+
+
+class TestLoadCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        LOAD_CACHE.clear()
+        self.dataset = Frame(filepath=os.path.join(self.directory.name, "frame"))
+
+    def tearDown(self):
+        LOAD_CACHE.clear()
+        self.directory.cleanup()
+
+    def test_copies_are_returned(self):
+        data = self.dataset.df
+        data["value"] = 0
+        self.assertEqual(self.dataset.df.value.sum(), sum(range(1000)))
+        self.assertEqual(len(LOAD_CACHE), 1)
+
+    def test_shared_reads_are_not_copied(self):
+        data = self.dataset.read(pd.read_pickle, shared=True)
+        self.assertIs(self.dataset.read(pd.read_pickle, shared=True), data)
+        self.assertIsNot(self.dataset.read(pd.read_pickle), data)
+
+    def test_data_larger_than_maxbytes(self):
+        with patch.object(LOAD_CACHE, "maxbytes", 100):
+            self.assertEqual(len(self.dataset.df), 1000)
+            self.assertEqual(len(LOAD_CACHE), 0)
+
+    def test_saving_invalidates(self):
+        self.dataset.df
+        self.dataset.save(pd.DataFrame({"value": [1]}))
+        self.assertEqual(len(LOAD_CACHE), 0)
+        self.assertEqual(self.dataset.df.value.tolist(), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
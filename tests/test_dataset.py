@@ -0,0 +1,111 @@
+import os, tempfile, unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from module.core.Cacheable import LOAD_CACHE
+from module.core.Dataset import ParquetDataset, SelectableDataFrame, sub_select
+
+
+def make_data(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    outlier_status = rng.choice(np.array(["normal", "suspected", "kept", False], dtype=object), n)
+    is_outlier = pd.Series(rng.choice([True, False], n), dtype=object).where(outlier_status != False)
+    return pd.DataFrame(
+        {
+            "mouse_id": rng.integers(1, 20, n).astype(float),
+            "value": rng.normal(size=n),
+            "compound": pd.Categorical(rng.choice(["DA", "5HT", "DA/5HT"], n)),
+            "region": rng.choice(["OF", "PL", "CB"], n),
+            "outlier_status": pd.Categorical(outlier_status),
+            "is_outlier": is_outlier,
+            "values": [[index, str(index)] for index in range(n)],  # mixed types, pickled
+        }
+    )
+
+
+class Frame(ParquetDataset):
+    filename = "frame"
+
+    def generate(self):
+        return make_data()
+
+
+class TestParquetDataset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        LOAD_CACHE.clear()
+        self.dataset = Frame(filepath=os.path.join(self.directory.name, "frame"))
+        self.data = make_data()
+
+    def tearDown(self):
+        LOAD_CACHE.clear()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        data = self.dataset.df
+        for column in ["mouse_id", "value", "region"]:
+            self.assertEqual(data[column].tolist(), self.data[column].tolist())
+        self.assertEqual(data.compound.dtype, self.data.compound.dtype)
+        self.assertEqual(data.outlier_status.astype(object).tolist(), self.data.outlier_status.astype(object).tolist())
+        self.assertEqual(
+            data.is_outlier.fillna("nan").tolist(), self.data.is_outlier.fillna("nan").tolist()
+        )
+        self.assertEqual(data.is_outlier.dtype, object)
+        self.assertEqual(data["values"].tolist(), self.data["values"].tolist())
+
+    def test_only_unstorable_columns_are_pickled(self):
+        metadata = pq.read_schema(self.dataset.filepath).metadata
+        self.assertEqual(metadata[b"pickled_columns"], b"values")
+        self.assertEqual(metadata[b"boolean_columns"], b"outlier_status,is_outlier")
+
+    def test_filters_as_in_memory_selection(self):
+        selectors = [
+            {"compound": "DA/5HT"},
+            {"compound": ["DA", "5HT"], "region": "OF"},
+            {"outlier_status": ["normal", "kept"]},
+            {"outlier_status": False},
+            {"is_outlier": True, "region": ["PL", "CB"]},
+            {"value": "notna", "mouse_id": lambda mouse_id: mouse_id > 10},
+        ]
+        for selector in selectors:
+            with self.subTest(selector=selector):
+                expected = sub_select(self.data, selector)
+                data = self.dataset.load(filters=selector)
+                self.assertEqual(data.index.size, len(expected))
+                self.assertEqual(data.value.tolist(), expected.value.tolist())
+
+    def test_label_filters_are_pushed_down(self):
+        with patch("module.core.Dataset.pq.read_table", wraps=pq.read_table) as read_table:
+            data = self.dataset.load(columns=["value"], filters={"compound": "DA", "region": ["OF", "PL"]})
+        self.assertEqual(
+            read_table.call_args.kwargs["filters"], [("compound", "==", "DA"), ("region", "in", ["OF", "PL"])]
+        )
+        self.assertEqual(data.columns.tolist(), ["value"])
+        self.assertEqual(len(data), len(sub_select(self.data, {"compound": "DA", "region": ["OF", "PL"]})))
+
+
+class TestSelectionIndex(unittest.TestCase):
+    def test_indexed_select_as_mask(self):
+        data = SelectableDataFrame(make_data(500, seed=1).drop(columns=["values"]))
+        indexed = SelectableDataFrame(data.copy()).build_selection_index()
+        selectors = [
+            {"compound": "DA"},
+            {"compound": ["DA", "5HT"], "region": ["OF", "CB"]},
+            {"region": "PL", "outlier_status": "suspected", "is_outlier": True},
+            {"compound": "DA", "value": "notna", "mouse_id": lambda mouse_id: mouse_id % 2 == 0},
+            {"is_outlier": "nan", "region": "OF"},
+            {"compound": "NA"},
+            {"compound": "DA", "region": None},
+        ]
+        for selector in selectors:
+            with self.subTest(selector=selector):
+                pd.testing.assert_frame_equal(indexed.select(**selector), data.select(**selector))
+        # selections of an indexed frame are indexed and keep giving the same results
+        selection = indexed.select(compound=["DA", "5HT"])
+        self.assertTrue(selection.has_selection_index)
+        pd.testing.assert_frame_equal(selection.select(region="OF"), data.select(compound=["DA", "5HT"], region="OF"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,333 @@
+import os, tempfile, unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from scipy import stats
+from module.core.FileSystem import FileSystem
+from module.core.HPLC import (
+    HPLC,
+    RATIO_CACHE,
+    FullHPLC,
+    Outliers,
+    calculate_ratios,
+    categorize,
+    concat_categorized,
+    has_ratios,
+    OUTLIER_TESTS,
+    generalized_esd_test,
+    iqr_test,
+    label_outliers,
+    mad_test,
+    rout_test,
+)
+
+
+def compound_data(compounds=("DA", "5HT", "NA"), regions=("OF", "PL"), n_mice=6, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = [
+        {"mouse_id": mouse, "group_id": mouse % 2 + 1, "value": rng.normal(5, 0.2), "compound": compound, "region": region}
+        for mouse in range(1, n_mice + 1)
+        for compound in compounds
+        for region in regions
+    ]
+    return pd.DataFrame(rows)
+
+
+class TestRatioCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = compound_data()
+        with patch.object(HPLC, "generate", return_value=self.data):
+            self.hplc = HPLC("TEST", filepath=os.path.join(self.directory.name, "hplc"))
+        RATIO_CACHE.clear()
+        self.maxsize = RATIO_CACHE.maxsize
+
+    def tearDown(self):
+        RATIO_CACHE.maxsize = self.maxsize
+        RATIO_CACHE.clear()
+        self.directory.cleanup()
+
+    def test_cached_ratios_evicted_by_new_ones(self):
+        RATIO_CACHE.maxsize = 2
+        self.hplc.get_ratios(self.data, ["DA/5HT", "5HT/DA"])
+        ratios = ["DA/5HT", "5HT/DA", "DA/NA", "NA/DA"]
+        ratio_data = self.hplc.get_ratios(self.data, ratios)
+        expected = calculate_ratios(self.data, ratios)
+        self.assertEqual(ratio_data.compound.unique().tolist(), ratios)
+        key = ["compound", "region", "mouse_id"]
+        pd.testing.assert_frame_equal(
+            ratio_data.sort_values(key).reset_index(drop=True),
+            expected.sort_values(key).reset_index(drop=True),
+        )
+        self.assertEqual(len(RATIO_CACHE), 2)
+
+    def test_materialize_selected_ratios(self):
+        data = self.hplc.materialize(["DA", "DA/5HT"])
+        self.assertEqual(set(data.compound.astype(str)), {"DA", "5HT", "NA", "DA/5HT"})
+        self.assertEqual(len(data.select(compound="DA/5HT")), 12)
+
+
+class TestConcatCategorized(unittest.TestCase):
+    def test_categories_are_unioned(self):
+        compounds = categorize(compound_data(compounds=("NA", "DA")))
+        ratios = categorize(calculate_ratios(compound_data(compounds=("NA", "DA"))))
+        weight = compound_data(compounds=("weight",))
+        with patch("pandas.concat", wraps=pd.concat) as concat:
+            data = concat_categorized([compounds, ratios, weight])
+        for frame in concat.call_args.args[0]:
+            self.assertEqual(frame.compound.dtype, data.compound.dtype)
+        self.assertIsInstance(data.compound.dtype, pd.CategoricalDtype)
+        expected = pd.concat([frame.astype({"compound": str, "region": str}) for frame in [compounds, ratios, weight]])
+        self.assertEqual(data.compound.cat.categories.tolist(), categorize(expected.copy()).compound.cat.categories.tolist())
+        self.assertEqual(data.compound.cat.categories[-3:].tolist(), ["NA/DA", "DA/NA", "weight"])
+        self.assertEqual(data.compound.astype(str).tolist(), expected.compound.tolist())
+        self.assertEqual(data.region.astype(str).tolist(), expected.region.tolist())
+
+
+def make_project(location, name, lazy_ratios=False):
+    """Writes the files of a small project, hplc is generated from raw_hplc"""
+    os.makedirs(os.path.join(location, name))
+    path = lambda filename: os.path.join(location, name, filename)
+    pd.DataFrame(
+        {
+            "label": [name],
+            "outlier_test": ["grubbs"],
+            "p_value_threshold": [0.05],
+            "raw_data_filename": ["raw_data.xlsx"],
+            "lazy_ratios": [lazy_ratios],
+        }
+    ).to_excel(path("project_information.xlsx"), index=False)
+    pd.DataFrame(
+        {"group_id": [1, 2], "label": ["vehicles", "TCB2"], "independant_variables": ["", "TCB2"]}
+    ).to_excel(path("treatment_information.xlsx"), index=False)
+    data = compound_data(n_mice=12)
+    data.loc[0, "value"] = 100  # grubbs outlier of DA, DA/5HT and DA/NA in OF
+    raw_data = data.pivot_table(index=["mouse_id", "group_id"], columns=["compound", "region"], values="value")
+    raw_data.columns = [f"{compound}_{region}" for compound, region in raw_data.columns]
+    raw_data.reset_index().to_pickle(path("raw_hplc.pkl"))
+    data[data.compound == "DA"].assign(compound="weight").to_pickle(path("tissue_weight.pkl"))
+
+
+def comparable(data):
+    data = pd.DataFrame(data).astype({"compound": str, "region": str, "outlier_status": str})
+    return data.sort_values(["compound", "region", "mouse_id"]).reset_index(drop=True)
+
+
+class TestLazyRatios(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = patch.object(FileSystem, "PROJECTS", self.directory.name)
+        self.patch.start()
+        make_project(self.directory.name, "EAGER")
+        make_project(self.directory.name, "LAZY", lazy_ratios=True)
+
+    def tearDown(self):
+        self.patch.stop()
+        RATIO_CACHE.clear()
+        self.directory.cleanup()
+
+    def test_ratios_are_not_stored(self):
+        self.assertFalse(HPLC("LAZY").stores_ratios)
+        self.assertFalse(Outliers("LAZY").stores_ratios)
+        self.assertFalse(has_ratios(FullHPLC("LAZY").df))
+        self.assertTrue(HPLC("EAGER").stores_ratios)
+        self.assertTrue(Outliers("EAGER").stores_ratios)
+
+    def test_ratios_derived_on_read(self):
+        lazy = HPLC("LAZY").select(compound="DA/5HT")
+        eager = HPLC("EAGER").select(compound="DA/5HT")
+        self.assertEqual(lazy.select(is_outlier=True).mouse_id.tolist(), [1])
+        pd.testing.assert_frame_equal(comparable(lazy), comparable(eager)[lazy.columns])
+        pd.testing.assert_frame_equal(
+            comparable(Outliers("LAZY").df), comparable(Outliers("EAGER").df), check_like=True
+        )
+
+    def test_full_df_derives_ratios_once(self):
+        FullHPLC("LAZY").df
+        with patch.object(HPLC, "derive_ratios", autospec=True, side_effect=HPLC.derive_ratios) as derive_ratios:
+            lazy = HPLC("LAZY").get_full_df()
+        self.assertEqual(derive_ratios.call_count, 1)
+        self.assertEqual(len(RATIO_CACHE), 0)
+        eager = HPLC("EAGER").full_df
+        pd.testing.assert_frame_equal(comparable(lazy), comparable(eager)[lazy.columns])
+
+    def test_compact_keeps_lazy_ratio_edits(self):
+        outliers = Outliers("LAZY")
+        suspected = outliers.load(filters={"compound": ["DA", "DA/5HT"], "outlier_status": "suspected"})
+        self.assertEqual(len(suspected), 2)
+        outliers.update(suspected.assign(outlier_status="eliminated"))
+        outliers.compact()
+        self.assertFalse(outliers.stores_ratios)
+        self.assertEqual(
+            outliers.load(filters={"outlier_status": "eliminated"}).compound.astype(str).tolist(),
+            ["DA", "DA/5HT"],
+        )
+        self.assertEqual(len(pd.read_csv(outliers.journal_filepath)), 1)
+
+
+class TestOutlierJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = patch.object(FileSystem, "PROJECTS", self.directory.name)
+        self.patch.start()
+        make_project(self.directory.name, "TEST")
+        self.outliers = Outliers("TEST")
+        self.full_hplc = FullHPLC("TEST")
+        self.suspected = self.outliers.load(filters={"outlier_status": "suspected"})
+
+    def tearDown(self):
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def eliminated(self, data):
+        return sorted(data.select(outlier_status="eliminated").compound.astype(str))
+
+    def test_edits_applied_on_read_without_rebuild(self):
+        self.full_hplc.df
+        modified = os.stat(self.full_hplc.filepath).st_mtime_ns
+        self.outliers.update(self.suspected.iloc[:2].assign(outlier_status="eliminated"))
+        self.assertFalse(self.full_hplc.is_outdated)
+        self.assertEqual(self.eliminated(self.outliers.df), sorted(self.suspected.compound.astype(str)[:2]))
+        self.assertEqual(self.eliminated(HPLC("TEST").full_df), self.eliminated(self.outliers.df))
+        self.assertEqual(
+            len(self.full_hplc.load(filters={"outlier_status": "eliminated"})), 2
+        )
+        self.assertEqual(os.stat(self.full_hplc.filepath).st_mtime_ns, modified)
+
+    def test_last_edit_wins_and_compact(self):
+        row = self.suspected.iloc[:1]
+        self.outliers.update(row.assign(outlier_status="eliminated"))
+        self.outliers.update(row.assign(outlier_status="kept"))
+        self.assertEqual(len(pd.read_csv(self.outliers.journal_filepath)), 2)
+        self.assertEqual(self.outliers.load(filters={"outlier_status": "kept"}).mouse_id.tolist(), row.mouse_id.tolist())
+        self.outliers.compact()
+        self.assertFalse(os.path.isfile(self.outliers.journal_filepath))
+        self.assertTrue(self.full_hplc.is_outdated)
+        self.assertEqual(len(self.full_hplc.load(filters={"outlier_status": "kept"})), 1)
+
+    def test_updates_do_not_read_the_journal(self):
+        with patch("module.core.HPLC.read_outlier_journal", side_effect=AssertionError("journal parsed")):
+            for status in ["eliminated", "kept", "eliminated"]:
+                Outliers("TEST").update(self.suspected.iloc[:2].assign(outlier_status=status))
+            self.assertEqual(Outliers("TEST").journal_length, 6)
+        # edits written elsewhere are counted
+        with open(self.outliers.journal_filepath, "a") as journal:
+            journal.write(f"{self.suspected.compound.iloc[0]},OF,1,1,kept\n")
+        self.assertEqual(self.outliers.journal_length, 7)
+        self.assertEqual(len(pd.read_csv(self.outliers.journal_filepath)), 7)
+
+    def test_journal_limit(self):
+        with patch.object(Outliers, "journal_limit", 2):
+            for status in ["eliminated", "kept", "eliminated"]:
+                self.outliers.update(self.suspected.iloc[:1].assign(outlier_status=status))
+        self.assertFalse(os.path.isfile(self.outliers.journal_filepath))
+        self.assertEqual(len(self.outliers.load(filters={"outlier_status": "eliminated"})), 1)
+
+
+def outlier_data():
+    """Small groups of values with outliers, untested values (0, nan) and a group of less than 3 values"""
+    groups = [
+        (1, "DA", "OF", [10.0, 10.2, 9.9, 10.1, 9.8, 10.3, 25.0]),
+        (2, "DA", "OF", [5.0, 5.1, 4.9, 5.2, 0.0, np.nan, 5.05, 1.0]),
+        (1, "5HT", "OF", [3.0, 3.1, np.nan]),
+        (2, "5HT", "OF", [1.0, 1.01, 0.99, 1.02, 0.98, 1.0, 1.01, 0.99, 3.0, 3.1]),
+        (1, "DA", "PL", [2.0, 2.5, 0.0, 2.2]),
+        (2, "DA", "PL", [7.0, 7.2, 6.9, 7.1, 12.0, 2.0]),
+    ]
+    return pd.DataFrame(
+        [
+            {"mouse_id": mouse, "group_id": group_id, "compound": compound, "region": region, "value": value}
+            for group_id, compound, region, values in groups
+            for mouse, value in enumerate(values, 1)
+        ]
+    )
+
+
+class TestGrubbs(unittest.TestCase):
+    def test_labels(self):
+        # as outlier_utils' smirnov_grubbs.test on the tested values (not null nor 0) of each group
+        data = label_outliers(outlier_data(), "grubbs", 0.05).sort_index()
+        self.assertEqual(data.index.tolist(), list(range(38)))
+        expected_outliers = [6, 14, 29]
+        untested = [15, 16, 17]
+        self.assertEqual(data.index[data.is_outlier == True].tolist(), expected_outliers)
+        self.assertEqual(data.index[data.is_outlier.isna()].tolist(), untested)
+        self.assertEqual(data.index[data.outlier_status == "suspected"].tolist(), expected_outliers)
+        self.assertEqual(data.index[data.outlier_status.astype(str) == "False"].tolist(), untested)
+        normal = data.drop(index=expected_outliers + untested)
+        self.assertEqual(set(zip(normal.is_outlier, normal.outlier_status)), {(False, "normal")})
+        # missing and 0 values of tested groups are normal
+        self.assertEqual(data.loc[[11, 12, 30], "outlier_status"].tolist(), ["normal"] * 3)
+        self.assertEqual(data.loc[[11, 12, 30], "is_outlier"].tolist(), [False] * 3)
+        # two close outliers mask each other
+        self.assertFalse(data.is_outlier[26:28].any())
+
+
+def reference_esd(values, alpha):
+    """Rosner's generalized ESD of one group, removing one value at a time (up to half of the values)"""
+    values = list(values)
+    n, removed, n_outliers = len(values), [], 0
+    for step in range(1, min(n // 2, n - 2) + 1):
+        mean, std = np.mean(values), np.std(values, ddof=1)
+        position = int(np.argmax(np.abs(np.array(values) - mean)))
+        r = abs(values[position] - mean) / std
+        t = stats.t.ppf(1 - alpha / (2 * (n - step + 1)), n - step - 1)
+        if r > (n - step) * t / np.sqrt((n - step - 1 + t**2) * (n - step + 1)):
+            n_outliers = step
+        removed.append(values.pop(position))
+    return removed[:n_outliers]
+
+
+class TestOutlierTests(unittest.TestCase):
+    def test_masks(self):
+        expected_outliers = {
+            "iqr": [6, 14, 26, 27, 36, 37],
+            "mad": [6, 14, 26, 27, 36, 37],
+            "esd": [6, 14, 26, 27, 36, 37],
+            "rout": [6, 14, 26, 27],
+        }
+        for test, expected in expected_outliers.items():
+            with self.subTest(test=test):
+                data = label_outliers(outlier_data(), test, 0.05).sort_index()
+                self.assertEqual(data.index[data.is_outlier == True].tolist(), expected)
+
+    def test_masks_of_groups(self):
+        values = pd.Series([1.0, 1.1, 0.9, 1.05, 4.0, 20.0, 21.0, 19.5, 20.5, 20.0, np.nan])
+        groups = pd.Series([0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1])
+        for test, expected in [(iqr_test, [4]), (mad_test, [4]), (generalized_esd_test, [4]), (rout_test, [4])]:
+            with self.subTest(test=test.__name__):
+                self.assertEqual(values.index[test(values, groups, 0.05)].tolist(), expected)
+        # constant values have a MAD of 0
+        self.assertFalse(mad_test(pd.Series([2.0, 2.0, 2.0, 5.0]), pd.Series([0, 0, 0, 0])).any())
+
+    def test_generalized_esd_as_reference(self):
+        rng = np.random.default_rng(0)
+        values, groups = [], []
+        for group in range(60):
+            group_values = rng.normal(size=rng.integers(3, 15))
+            n_outliers = rng.integers(0, 4)
+            group_values[:n_outliers] += rng.choice([-1, 1], n_outliers) * rng.uniform(2, 8, n_outliers)
+            values.extend(group_values)
+            groups.extend([group] * len(group_values))
+        values, groups = pd.Series(values), pd.Series(groups)
+        for alpha in [0.05, 0.01]:
+            is_outlier = generalized_esd_test(values, groups, alpha)
+            for group, group_values in values.groupby(groups):
+                with self.subTest(alpha=alpha, group=group):
+                    self.assertEqual(
+                        sorted(group_values[is_outlier[group_values.index]]), sorted(reference_esd(group_values, alpha))
+                    )
+
+    def test_missing_values_are_normal(self):
+        # 0 and missing values are not tested, in tested groups they are labelled normal (not suspected)
+        for test in OUTLIER_TESTS:
+            with self.subTest(test=test):
+                data = label_outliers(outlier_data(), test, 0.05).sort_index()
+                self.assertEqual(data.loc[[11, 12, 30], "outlier_status"].tolist(), ["normal"] * 3)
+                self.assertEqual(data.loc[[11, 12, 30], "is_outlier"].tolist(), [False] * 3)
+                self.assertEqual(data.loc[[15, 16, 17], "outlier_status"].tolist(), [False] * 3)
+                self.assertTrue(data.loc[[15, 16, 17], "is_outlier"].isna().all())
+
+
+if __name__ == "__main__":
+    unittest.main()
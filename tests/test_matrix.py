@@ -0,0 +1,336 @@
+import os, tempfile, unittest, warnings
+from types import SimpleNamespace
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy
+from statsmodels.stats.multitest import multipletests
+from module.core.Cacheable import LOAD_CACHE
+from module.core.Matrix import (
+    MATRIX_CACHE,
+    Matrix,
+    MatrixStore,
+    Network,
+    calculate_matrices,
+    get_matrix_hash,
+    kendall_correlations,
+    correlation_matrix,
+    correct_pvalues,
+    resampled_pvalues,
+)
+from module.core.utils import BACKENDS, POOL_SETTINGS, configure_pool, parallel_process
+
+
+def random_values(observations=12, variables=5, seed=0, ties=True, missing=True):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(observations, variables))
+    if ties:
+        values[:, 0] = np.round(values[:, 0])
+    if missing:
+        values[rng.random(values.shape) < 0.15] = np.nan
+    return values
+
+
+def scipy_kendall(values):
+    variables = values.shape[1]
+    correlations, pvalues = np.full((variables, variables), np.nan), np.full((variables, variables), np.nan)
+    for i in range(variables):
+        for j in range(variables):
+            shared = ~np.isnan(values[:, i]) & ~np.isnan(values[:, j])
+            if shared.sum() >= 2:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    result = scipy.stats.kendalltau(values[shared, i], values[shared, j])
+                correlations[i, j], pvalues[i, j] = result.statistic, result.pvalue
+    return correlations, pvalues
+
+
+class TestKendall(unittest.TestCase):
+    def assert_as_scipy(self, values):
+        correlations, pvalues = kendall_correlations(values)
+        expected_correlations, expected_pvalues = scipy_kendall(values)
+        off_diagonal = ~np.eye(values.shape[1], dtype=bool)
+        np.testing.assert_allclose(correlations[off_diagonal], expected_correlations[off_diagonal], atol=1e-12)
+        np.testing.assert_allclose(pvalues[off_diagonal], expected_pvalues[off_diagonal], atol=1e-10)
+
+    def test_batched_as_scipy(self):
+        for seed, observations in [(0, 12), (1, 40), (2, 8)]:
+            with self.subTest(observations=observations):
+                self.assert_as_scipy(random_values(observations, seed=seed))
+
+    def test_exact_pvalues_without_ties(self):
+        self.assert_as_scipy(random_values(20, ties=False, missing=False))
+
+    def test_pairwise_fallback_above_the_limits(self):
+        values = random_values(30, 6, seed=3)
+        batched = kendall_correlations(values)
+        with patch("module.core.Matrix.KENDALL_BATCH_ELEMENTS", 0):
+            with patch("module.core.Matrix.scipy.stats.kendalltau", wraps=scipy.stats.kendalltau) as kendalltau:
+                pairwise = kendall_correlations(values)
+        self.assertGreater(kendalltau.call_count, 0)
+        off_diagonal = ~np.eye(6, dtype=bool)
+        for batched_result, pairwise_result in zip(batched, pairwise):
+            np.testing.assert_allclose(batched_result[off_diagonal], pairwise_result[off_diagonal], atol=1e-10)
+
+
+class TestCorrelationMatrix(unittest.TestCase):
+    def setUp(self):
+        self.pivot = pd.DataFrame(random_values(15, 6, seed=4), columns=list("abcdef"))
+
+    def test_correlations_as_dataframe_corr(self):
+        for method in ["pearson", "spearman", "kendall"]:
+            for min_periods in [3, 12]:
+                with self.subTest(method=method, min_periods=min_periods):
+                    correlations, _, n = correlation_matrix(self.pivot, method, min_periods)
+                    expected = self.pivot.corr(method, min_periods=min_periods)
+                    pd.testing.assert_frame_equal(correlations, expected, atol=1e-12)
+                    self.assertEqual(n.to_numpy().tolist(), (self.pivot.notna().T.astype(int) @ self.pivot.notna()).to_numpy().tolist())
+
+    def test_pvalues_as_scipy(self):
+        tests = {"pearson": scipy.stats.pearsonr, "spearman": scipy.stats.spearmanr, "kendall": scipy.stats.kendalltau}
+        for method, test in tests.items():
+            with self.subTest(method=method):
+                _, pvalues, _ = correlation_matrix(self.pivot, method, 3)
+                expected = self.pivot.corr(lambda x, y: test(x, y).pvalue, min_periods=3)
+                np.fill_diagonal(expected.values, 1)
+                pd.testing.assert_frame_equal(pvalues, expected, atol=1e-10)
+
+
+class TestResampledPvalues(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        values = rng.normal(size=(20, 4))
+        values[:, 1] += values[:, 0]
+        values[rng.random(values.shape) < 0.1] = np.nan
+        self.pivot = pd.DataFrame(values, columns=list("abcd"))
+
+    def test_reproducible_with_a_seed(self):
+        for method in ["pearson", "spearman"]:
+            for resampling in ["permutation", "bootstrap"]:
+                with self.subTest(method=method, resampling=resampling):
+                    pvalues = resampled_pvalues(self.pivot, method, resampling, 200, 3, seed=1)
+                    pd.testing.assert_frame_equal(pvalues, resampled_pvalues(self.pivot, method, resampling, 200, 3, seed=1))
+                    self.assertFalse(pvalues.equals(resampled_pvalues(self.pivot, method, resampling, 200, 3, seed=2)))
+
+    def test_same_pvalues_whatever_the_backend(self):
+        with patch("module.core.Matrix.RESAMPLING_CHUNK_ELEMENTS", 20 * 4**2 * 50):
+            serial = resampled_pvalues(self.pivot, "pearson", "permutation", 200, seed=1)
+            threaded = resampled_pvalues(self.pivot, "pearson", "permutation", 200, seed=1, backend="thread")
+        pd.testing.assert_frame_equal(serial, threaded)
+
+    def test_permutation_close_to_t_distribution(self):
+        pvalues = resampled_pvalues(self.pivot, "pearson", "permutation", 4000, seed=0)
+        _, expected, _ = correlation_matrix(self.pivot, "pearson")
+        np.testing.assert_allclose(pvalues.to_numpy(), expected.to_numpy(), atol=0.03)
+        np.testing.assert_array_equal(np.diag(pvalues), 1)
+
+    def test_unknown_resampling(self):
+        with self.assertRaises(ValueError):
+            resampled_pvalues(self.pivot, "pearson", "jackknife")
+        with self.assertRaises(ValueError):
+            resampled_pvalues(self.pivot, "kendall", "permutation")
+
+
+class TestCorrectPvalues(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.pvalues = pd.DataFrame(rng.random((5, 4)) ** 3, index=list("abcde"), columns=list("fghi"))
+        self.pvalues.iloc[1, 2] = np.nan
+
+    def test_as_multipletests(self):
+        tested = self.pvalues.notna().to_numpy()
+        for correction, method in [("bh", "fdr_bh"), ("bonferroni", "bonferroni"), ("holm", "holm")]:
+            with self.subTest(correction=correction):
+                corrected = correct_pvalues(self.pvalues, correction)
+                np.testing.assert_allclose(
+                    corrected.to_numpy()[tested], multipletests(self.pvalues.to_numpy()[tested], method=method)[1]
+                )
+                self.assertTrue(np.isnan(corrected.iloc[1, 2]))
+                self.assertEqual(corrected.index.tolist(), self.pvalues.index.tolist())
+
+    def test_lower_triangle_of_symmetric_matrix(self):
+        values = np.tril(np.random.default_rng(7).random((5, 5)) ** 3, k=-1)
+        pvalues = pd.DataFrame(values + values.T + np.eye(5), index=list("abcde"), columns=list("abcde"))
+        corrected = correct_pvalues(pvalues, "bh", lower_triangle=True)
+        lower = np.tri(5, k=-1, dtype=bool)
+        np.testing.assert_allclose(corrected.to_numpy()[lower], multipletests(pvalues.to_numpy()[lower], method="fdr_bh")[1])
+        np.testing.assert_array_equal(corrected.to_numpy(), corrected.to_numpy().T)
+        np.testing.assert_array_equal(np.diag(corrected), 1)
+
+    def test_no_correction(self):
+        corrected = correct_pvalues(self.pvalues, None)
+        pd.testing.assert_frame_equal(corrected, self.pvalues)
+        self.assertIsNot(corrected, self.pvalues)
+        with self.assertRaises(ValueError):
+            correct_pvalues(self.pvalues, "sidak")
+
+
+def make_network(corr_masked, is_square=False):
+    """Network of a masked correlation matrix, without the data of a Matrix"""
+    return Network(SimpleNamespace(corr_masked=corr_masked, is_square=is_square), delay_execution=False)
+
+
+def length_graph(network, weighted):
+    """networkx graph of the network without self loops, edge lengths as Network.lengths"""
+    G = nx.DiGraph() if network.is_directed else nx.Graph()
+    G.add_nodes_from(network.nodes)
+    G.add_edges_from(
+        (row, col, {"length": 1 / abs(correlation) if weighted else 1})
+        for row, col, correlation in network.edges
+        if row != col
+    )
+    return G
+
+
+def nx_efficiency(G):
+    n_nodes = len(G)
+    if n_nodes < 2:
+        return 0
+    lengths = dict(nx.all_pairs_dijkstra_path_length(G, weight="length"))
+    return sum(1 / length for source in lengths for target, length in lengths[source].items() if source != target) / (
+        n_nodes * (n_nodes - 1)
+    )
+
+
+def nx_local_efficiency(G):
+    neighbors = {node: set(nx.all_neighbors(G, node)) - {node} for node in G}
+    return np.mean([nx_efficiency(G.subgraph(neighbors[node])) if len(neighbors[node]) > 1 else 0 for node in G])
+
+
+class TestNetwork(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(10)
+        nodes = list("abcdefg")
+        values = np.tril(rng.uniform(-1, 1, (7, 7)), k=-1)
+        values = values + values.T + np.eye(7)
+        values[np.abs(values) < 0.4] = np.nan
+        self.corr_masked = pd.DataFrame(values, index=nodes, columns=nodes)
+        self.corr_masked.loc["g", :] = self.corr_masked.loc[:, "g"] = np.nan
+        self.corr_masked.loc["g", "g"] = 1
+
+    def test_array_metrics_as_networkx(self):
+        network = make_network(self.corr_masked)
+        G = network.G
+        self.assertEqual(network.total_edges, G.number_of_edges())
+        self.assertEqual(network.pos_edges, sum(color == "red" for *_, color in G.edges(data="color")))
+        self.assertAlmostEqual(network.density, nx.density(G))
+        self.assertEqual(network.max_degree, max(degree for _, degree in G.degree))
+        self.assertAlmostEqual(network.average_degree, np.mean([degree for _, degree in G.degree]))
+        self.assertAlmostEqual(network.avg_clust_coeff_unweighted, nx.average_clustering(G))
+        self.assertAlmostEqual(network.avg_clust_coeff_weighted, nx.average_clustering(G, weight="weight"))
+
+    def test_undirected_as_networkx(self):
+        network = make_network(self.corr_masked)
+        G = length_graph(network, weighted=False)
+        self.assertAlmostEqual(network.global_eff_unweighted, nx.global_efficiency(G))
+        self.assertAlmostEqual(network.local_eff_unweighted, nx.local_efficiency(G))
+        self.assertAlmostEqual(network.global_eff_weighted, nx_efficiency(length_graph(network, weighted=True)))
+        self.assertAlmostEqual(network.local_eff_weighted, nx_local_efficiency(length_graph(network, weighted=True)))
+        # g is isolated
+        self.assertIsNone(network.path_length_unweighted)
+        self.assertIsNone(network.path_length_weighted)
+
+    def test_connected_path_lengths_as_networkx(self):
+        network = make_network(self.corr_masked.drop(index="g", columns="g"))
+        self.assertTrue(nx.is_connected(network.G))
+        for weighted, path_length in [(False, network.path_length_unweighted), (True, network.path_length_weighted)]:
+            with self.subTest(weighted=weighted):
+                G = length_graph(network, weighted)
+                self.assertAlmostEqual(path_length, nx.average_shortest_path_length(G, weight="length"))
+
+    def test_directed_as_networkx(self):
+        rng = np.random.default_rng(9)
+        values = rng.uniform(-1, 1, (4, 5))
+        values[np.abs(values) < 0.3] = np.nan
+        corr_masked = pd.DataFrame(values, index=list("abcd"), columns=list("bcdef"))
+        network = make_network(corr_masked, is_square=True)
+        for weighted in [False, True]:
+            with self.subTest(weighted=weighted):
+                G = length_graph(network, weighted)
+                efficiencies = (
+                    (network.global_eff_weighted, network.local_eff_weighted)
+                    if weighted
+                    else (network.global_eff_unweighted, network.local_eff_unweighted)
+                )
+                self.assertAlmostEqual(efficiencies[0], nx_efficiency(G))
+                self.assertAlmostEqual(efficiencies[1], nx_local_efficiency(G))
+
+
+def make_matrices(n_mice=8, seed=0):
+    """Delayed compound self correlation matrices of random data, one per region"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        [
+            {"mouse_id": mouse, "compound": compound, "region": region, "value": rng.normal()}
+            for mouse in range(1, n_mice + 1)
+            for compound in ["DA", "5HT"]
+            for region in ["OF", "PL", "CB"]
+        ]
+    )
+    return [
+        Matrix(data.assign(value=data.value + position), "vehicles", "compound", compound, compound, "region")
+        for position, compound in enumerate(["DA", "5HT"])
+    ]
+
+
+class TestCalculateMatrices(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(POOL_SETTINGS)
+        configure_pool(backend="serial")
+        MATRIX_CACHE.clear()
+        LOAD_CACHE.clear()
+
+    def tearDown(self):
+        configure_pool(**self.settings)
+        MATRIX_CACHE.clear()
+        LOAD_CACHE.clear()
+        self.directory.cleanup()
+
+    def calculate(self, matrices, store=None):
+        with patch("module.core.Matrix.parallel_process", wraps=parallel_process) as wrapped:
+            return calculate_matrices(matrices, store), wrapped
+
+    def test_cached_matrices_are_not_recalculated(self):
+        matrices, parallel_process = self.calculate(make_matrices())
+        self.assertEqual(len(parallel_process.call_args.args[0]), 2)
+        self.assertEqual(len(MATRIX_CACHE), 2)
+        # same content: cache hits, new delayed matrices are not executed
+        again, parallel_process = self.calculate(make_matrices())
+        parallel_process.assert_not_called()
+        for matrix, cached in zip(again, matrices):
+            pd.testing.assert_frame_equal(matrix.correlations, cached.correlations)
+        # other data: calculated
+        _, parallel_process = self.calculate(make_matrices(seed=1)[:1])
+        self.assertEqual(len(parallel_process.call_args.args[0]), 1)
+
+    def test_copies_are_returned(self):
+        matrix = self.calculate(make_matrices())[0][0]
+        cached = MATRIX_CACHE[get_matrix_hash(make_matrices()[0])]
+        self.assertIsNot(matrix, cached)
+        matrix.corr_masked = None
+        self.assertIsNotNone(cached.corr_masked)
+        self.assertIsNot(self.calculate(make_matrices())[0][0], cached)
+
+    def test_matrices_persisted_in_store(self):
+        store = MatrixStore("TEST", filepath=os.path.join(self.directory.name, "matrices"))
+        matrices, _ = self.calculate(make_matrices(), store)
+        self.assertEqual(sorted(store.load()), sorted(get_matrix_hash(matrix) for matrix in make_matrices()))
+        # loaded matrices are not copied
+        self.assertIs(store.load(), store.load())
+        MATRIX_CACHE.clear()
+        LOAD_CACHE.clear()
+        stored, parallel_process = self.calculate(make_matrices(), store)
+        parallel_process.assert_not_called()
+        for matrix, calculated in zip(stored, matrices):
+            pd.testing.assert_frame_equal(matrix.corr_masked, calculated.corr_masked)
+
+    def test_backend_setting_is_used(self):
+        with patch.dict(BACKENDS, thread=lambda *args: self.fail("thread backend used")):
+            configure_pool(backend="serial", in_process_threshold=1)
+            self.assertEqual(len(self.calculate(make_matrices())[0]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
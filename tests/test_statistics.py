@@ -0,0 +1,279 @@
+import os, tempfile, unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from module.core.Dataset import SelectableDataFrame
+from module.core.FileSystem import FileSystem
+from module.core.Statistics import (
+    QuantitativeStatistic,
+    STATISTICS_CACHE,
+    StatisticsCache,
+    StatisticsCacheShard,
+    Statistics,
+    batch_one_way_anova,
+    batch_ttest,
+    batch_tukey,
+    calculate_statistics,
+)
+from module.core.utils import configure_pool, shutdown_pool, POOL_SETTINGS, CaseError
+
+
+def grouping_results(grouping_hash, p_value_threshold):
+    return pd.DataFrame(
+        {
+            "test": ["one_way_anova", "tukey"],
+            "p_value_threshold": p_value_threshold,
+            "compound": "DA",
+            "region": "OF",
+            "grouping_hash": grouping_hash,
+        }
+    )
+
+
+class TestStatisticsCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = patch.object(FileSystem, "PROJECTS", self.directory.name)
+        self.patch.start()
+        os.mkdir(os.path.join(self.directory.name, "TEST"))
+        self.cache = StatisticsCache("TEST")
+
+    def tearDown(self):
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def test_results_keyed_by_grouping_hash(self):
+        # same grouping with two thresholds: two hashes, both kept
+        self.cache.update(grouping_results("aa01", 0.05))
+        self.cache.update(grouping_results("aa02", 0.01))
+        results = self.cache.get_results(["aa01", "aa02", "bb01"])
+        self.assertEqual(sorted(results), ["aa01", "aa02"])
+        self.assertEqual(results["aa02"].p_value_threshold.tolist(), [0.01, 0.01])
+
+    def test_update_replaces_rows_of_its_shards_only(self):
+        self.cache.update(pd.concat([grouping_results("aa01", 0.05), grouping_results("bb01", 0.05)]))
+        other_shard = f"{self.cache.get_shard_filepath('bb')}.{StatisticsCacheShard.extension}"
+        modified = os.stat(other_shard).st_mtime_ns
+        self.cache.update(grouping_results("aa01", 0.01))
+        self.assertEqual(os.stat(other_shard).st_mtime_ns, modified)
+        results = self.cache.get_results(["aa01", "bb01"])
+        self.assertEqual(results["aa01"].p_value_threshold.tolist(), [0.01, 0.01])
+        self.assertEqual(len(results["bb01"]), 2)
+
+
+    def test_only_last_versions_of_a_grouping_are_kept(self):
+        grouping_hashes = [f"{prefix}01" for prefix in ["aa", "bb", "cc", "dd", "ee"]]
+        for grouping_hash in grouping_hashes:
+            self.cache.update(grouping_results(grouping_hash, 0.05))
+        self.cache.update(grouping_results("ff01", 0.05).assign(region="CB"))
+        self.assertEqual(StatisticsCache.max_versions, 4)
+        self.assertEqual(sorted(self.cache.get_results([*grouping_hashes, "ff01"])), [*grouping_hashes[1:], "ff01"])
+        self.assertNotIn(f"aa.{StatisticsCacheShard.extension}", os.listdir(self.cache.location))
+        # updating a version makes it the last one
+        self.cache.update(grouping_results("bb01", 0.01))
+        self.cache.update(grouping_results("aa02", 0.05))
+        self.assertEqual(sorted(self.cache.get_results(["bb01", "cc01", "dd01", "ee01", "aa02"])), ["aa02", "bb01", "dd01", "ee01"])
+
+    def test_clear(self):
+        self.cache.update(pd.concat([grouping_results("aa01", 0.05), grouping_results("bb01", 0.05)]))
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache.location), [])
+        self.assertEqual(self.cache.get_results(["aa01", "bb01"]), {})
+
+    def test_statistics_from_scratch_clears_the_cache(self):
+        with patch.object(QuantitativeStatistic, "calculate", return_value=SelectableDataFrame({"fully_significant": [True]})) as calculate:
+            Statistics("TEST", from_scratch=True)
+        calculate.assert_called_once_with("TEST", from_scratch=True)
+
+INDEPENDANT_VARIABLES = {"vehicles": [], "TCB2": ["TCB2"], "MDL": ["MDL"], "TCB2+MDL": ["TCB2", "MDL"]}
+
+
+def make_groupings(n_groupings, treatments=("vehicles", "TCB2", "MDL"), n_mice=6, seed=0, p_value_threshold=0.05, **kwargs):
+    """Delayed statistics of random data, kwargs are passed to QuantitativeStatistic"""
+    rng = np.random.default_rng(seed)
+    groupings = []
+    for position in range(n_groupings):
+        data = SelectableDataFrame(
+            {
+                "mouse_id": np.arange(len(treatments) * n_mice),
+                "treatment": np.repeat(treatments, n_mice),
+                "independant_variables": [INDEPENDANT_VARIABLES[treatment] for treatment in np.repeat(treatments, n_mice)],
+                "value": rng.normal(np.repeat(rng.normal(0, 1, len(treatments)), n_mice), 1),
+            }
+        )
+        groupings.append(
+            QuantitativeStatistic(
+                data,
+                sorted({variable for treatment in treatments for variable in INDEPENDANT_VARIABLES[treatment]}),
+                list(treatments),
+                False,
+                True,
+                p_value_threshold,
+                delay_execution=True,
+                metadata={"region": str(position)},
+                **kwargs,
+            )
+        )
+    return groupings
+
+
+class TestCalculateStatistics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.settings = dict(POOL_SETTINGS)
+
+    def tearDown(self):
+        configure_pool(**self.settings)
+        shutdown_pool()
+
+    def test_data_not_shared_in_process(self):
+        configure_pool(backend="serial")
+        groupings = make_groupings(6, pipeline=["ttest_unknown"])
+        with patch("module.core.Statistics.SharedFrame") as shared_frame:
+            with self.assertRaises(CaseError):
+                calculate_statistics(groupings)
+        shared_frame.assert_not_called()
+
+    def test_data_restored_when_a_case_fails(self):
+        configure_pool(backend="process", size=2, in_process_threshold=1)
+        groupings = make_groupings(6, pipeline=["ttest_unknown"])
+        data = [grouping.data for grouping in groupings]
+        with self.assertRaises(CaseError):
+            calculate_statistics(groupings)
+        for grouping, grouping_data in zip(groupings, data):
+            self.assertIs(grouping.data, grouping_data)
+
+    def test_process_results_keep_the_data(self):
+        configure_pool(backend="process", size=2, in_process_threshold=1)
+        groupings = make_groupings(4, treatments=tuple(INDEPENDANT_VARIABLES))
+        statistics = calculate_statistics(groupings)
+        for grouping, statistic in zip(groupings, statistics):
+            self.assertIs(statistic.data, grouping.data)
+            self.assertIsInstance(grouping.data, pd.DataFrame)
+
+
+class TestBatchTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.settings = dict(POOL_SETTINGS)
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_pool(**cls.settings)
+
+    def setUp(self):
+        self.groupings = make_groupings(5, treatments=tuple(INDEPENDANT_VARIABLES), seed=1) + make_groupings(
+            3, n_mice=7, seed=2, p_value_threshold=0.01
+        )
+        # missing values are not tested
+        self.groupings[0].data.loc[[0, 9], "value"] = np.nan
+        for grouping in self.groupings:
+            grouping.filtered_data = grouping.data.select(value="notna")
+
+    def assert_results_equal(self, result, expected):
+        self.assertEqual(result["p_value"], expected["p_value"])
+        self.assertEqual(result["is_significant"], expected["is_significant"])
+        self.assertEqual(result["result_string"], expected["result_string"])
+
+    def test_one_way_anova(self):
+        for grouping, result in zip(self.groupings, batch_one_way_anova(self.groupings)):
+            expected = grouping.get_one_way_anova()
+            self.assert_results_equal(result, expected)
+            pd.testing.assert_frame_equal(result["result"], expected["result"], check_exact=False)
+
+    def test_ttest(self):
+        groupings = make_groupings(4, treatments=("vehicles", "TCB2"), seed=3)
+        groupings[1].data.loc[[2], "value"] = np.nan
+        for grouping in groupings:
+            grouping.filtered_data = grouping.data.select(value="notna")
+        for grouping, result in zip(groupings, batch_ttest(groupings)):
+            expected = grouping.get_ttest()
+            self.assert_results_equal(result, expected)
+            pd.testing.assert_frame_equal(result["result"], expected["result"], check_exact=False)
+        # only defined between two treatments
+        self.assertEqual(batch_ttest(self.groupings[:1]), [None])
+
+    def test_two_treatments_are_batched_ttests(self):
+        configure_pool(backend="serial")
+        groupings = make_groupings(4, treatments=("vehicles", "TCB2"), seed=4) + make_groupings(
+            2, treatments=("vehicles", "TCB2+MDL"), seed=5
+        )
+        self.assertEqual({tuple(grouping.pipeline) for grouping in groupings}, {("ttest",)})
+        with patch.object(QuantitativeStatistic, "get_ttest", autospec=True, side_effect=QuantitativeStatistic.get_ttest) as get_ttest:
+            statistics = calculate_statistics(groupings)
+            get_ttest.assert_not_called()
+            for statistic in statistics:
+                self.assertTrue(statistic.has_enough_data)
+                self.assert_results_equal(
+                    statistic.results.select(test="ttest").iloc[0], statistic.get_ttest()
+                )
+
+    def test_ttest_from_selection(self):
+        STATISTICS_CACHE.clear()
+        data = pd.concat(
+            [
+                grouping.data.assign(compound="DA", region=str(position))
+                for position, grouping in enumerate(make_groupings(3, treatments=("vehicles", "TCB2"), seed=6))
+            ]
+        )
+        experiment = pd.Series(
+            {
+                "label": "agonist",
+                "independant_variables": ["TCB2"],
+                "treatments": ["vehicles", "TCB2"],
+                "paired": False,
+                "parametric": True,
+            }
+        )
+        _, results = QuantitativeStatistic.calculate_from_selection(SelectableDataFrame(data), experiment, 0.05)
+        STATISTICS_CACHE.clear()
+        self.assertEqual(results.test.tolist(), ["ttest"] * 3)
+        self.assertNotIn("n/a", results.result_string.tolist())
+
+    def test_tukey(self):
+        for grouping, result in zip(self.groupings, batch_tukey(self.groupings)):
+            expected = grouping.get_tukey()
+            pd.testing.assert_frame_equal(
+                result["result"], expected["result"].astype(result["result"].dtypes), check_exact=False
+            )
+            self.assertEqual(result["is_significant"], expected["is_significant"])
+            self.assertEqual(result["p_value"], expected["p_value"])
+
+
+class TestCalculateFromSelection(unittest.TestCase):
+    def setUp(self):
+        STATISTICS_CACHE.clear()
+        self.data = pd.concat(
+            [grouping.data.assign(compound="DA", region=str(position)) for position, grouping in enumerate(make_groupings(3))]
+        )
+        self.experiment = pd.Series(
+            {
+                "label": "dose response",
+                "independant_variables": ["TCB2"],
+                "treatments": ["vehicles", "TCB2", "MDL"],
+                "paired": False,
+                "parametric": True,
+            }
+        )
+
+    def tearDown(self):
+        STATISTICS_CACHE.clear()
+
+    def test_memoized_results_are_not_modified(self):
+        statistics, results = QuantitativeStatistic.calculate_from_selection(
+            SelectableDataFrame(self.data), self.experiment, 0.05
+        )
+        self.assertIn("fully_significant", results)
+        self.assertEqual(len(STATISTICS_CACHE), 3)
+        for statistic in STATISTICS_CACHE.values():
+            self.assertNotIn("fully_significant", statistic.results)
+        memoized, memoized_results = QuantitativeStatistic.calculate_from_selection(
+            SelectableDataFrame(self.data), self.experiment, 0.05
+        )
+        self.assertEqual([id(statistic) for statistic in memoized], [id(statistic) for statistic in statistics])
+        columns = ["test", "region", "is_significant", "fully_significant"]
+        pd.testing.assert_frame_equal(memoized_results[columns], results[columns])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+import pandas as pd
+from module.core.utils import (
+    parallel_process,
+    get_chunksize,
+    configure_pool,
+    shutdown_pool,
+    POOL_SETTINGS,
+    CaseError,
+    SharedFrame,
+    SharedRows,
+    get_content_hash,
+)
+
+
+def square(value):
+    return value**2
+
+
+def inverse(value):
+    return 1 / value
+
+
+def total(rows):
+    return rows.load().value.sum()
+
+
+class TestParallelProcess(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.settings = dict(POOL_SETTINGS)
+        configure_pool(size=2, in_process_threshold=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        configure_pool(**cls.settings)
+        shutdown_pool()
+
+    def test_backends_return_results_in_order(self):
+        cases = list(range(20))
+        for backend in ["serial", "thread", "process"]:
+            with self.subTest(backend=backend):
+                results = parallel_process(cases, square, backend=backend, chunksize=3)
+                self.assertEqual(results, [case**2 for case in cases])
+
+    def test_case_error_identifies_the_case(self):
+        for backend in ["serial", "thread", "process"]:
+            with self.subTest(backend=backend):
+                with self.assertRaises(CaseError) as context:
+                    parallel_process([1, 2, 0, 4], inverse, backend=backend)
+                self.assertEqual(context.exception.index, 2)
+                self.assertEqual(context.exception.case, "0")
+                self.assertIn("ZeroDivisionError", context.exception.error)
+
+    def test_shared_rows_in_processes(self):
+        data = pd.DataFrame({"value": np.arange(100, dtype=float)})
+        with SharedFrame(data) as frame:
+            cases = [SharedRows(frame, start, start + 10) for start in range(0, 100, 10)]
+            results = parallel_process(cases, total, backend="process")
+        self.assertEqual(results, [data.value[start : start + 10].sum() for start in range(0, 100, 10)])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            parallel_process([1], square, backend="gpu")
+
+    def test_chunksize(self):
+        self.assertEqual(get_chunksize(100, 4), 7)
+        self.assertEqual(get_chunksize(32, 4), 2)
+        self.assertEqual(get_chunksize(1, 8), 1)
+
+
+class TestContentHash(unittest.TestCase):
+    def test_values_and_settings(self):
+        data = pd.DataFrame({"mouse_id": [1, 2], "value": [0.5, np.nan]})
+        content_hash = get_content_hash(data, ("pearson", 0.05))
+        self.assertEqual(content_hash, get_content_hash(data.set_axis([5, 6]), ("pearson", 0.05)))
+        self.assertNotEqual(content_hash, get_content_hash(data.assign(value=[0.5, 1]), ("pearson", 0.05)))
+        self.assertNotEqual(content_hash, get_content_hash(data, ("pearson", 0.01)))
+
+
+class TestSharedFrame(unittest.TestCase):
+    def test_rows_round_trip(self):
+        data = pd.DataFrame(
+            {
+                "value": np.arange(10, dtype=float),
+                "compound": pd.Categorical(list("ababababab")),
+                "label": ["x", None, "y", "x", "z", "y", "x", None, "y", "z"],
+                "values": [[index] for index in range(10)],
+            },
+            index=np.arange(10) * 2,
+        )
+        with SharedFrame(data) as frame:
+            rows = frame.rows(3, 7)
+            self.assertEqual(rows.index.tolist(), data.index[3:7].tolist())
+            self.assertEqual(rows.value.tolist(), data.value[3:7].tolist())
+            self.assertEqual(rows.compound.tolist(), data.compound[3:7].tolist())
+            self.assertEqual(rows.label.tolist(), ["x", "z", "y", "x"])
+            self.assertEqual(rows["values"].tolist(), [[3], [4], [5], [6]])
+            self.assertEqual(len(frame.rows(5, 5)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()